@@ -0,0 +1,119 @@
+import asyncio
+import json
+from scheduler import AsyncRequestScheduler, ResponseError
+from services import GENERATION_PATH, TOKEN_HEADERS, token_manager, token_request
+
+# aiohttp is loaded when an AsyncServices is opened, like requests and the SDKs in services
+
+STT_MODEL = "en-US_BroadbandModel"
+BLOCK_SIZE = 64 * 1024
+
+
+class AsyncServices:
+    # the IAM, watsonx.ai, TTS and STT calls of one job as coroutines on a single event
+    # loop: one aiohttp session keeps connections alive for all of them, and every service
+    # has its own scheduler so each can have hundreds of requests in flight without a
+    # thread per request. Use it as an async context manager
+    def __init__(self, settings, limits):
+        self.settings = settings
+        self.limits = limits
+        self.schedulers = {name: AsyncRequestScheduler(name, limit) for name, limit in limits.items()}
+        # tokens are shared with the threaded path and every other job, like get_token's
+        self.tokens = token_manager
+        self.token_lock = asyncio.Lock()
+        self.session = None
+
+    async def __aenter__(self):
+        import aiohttp
+
+        self.errors = (aiohttp.ClientError,)
+        connector = aiohttp.TCPConnector(limit=sum(self.limits.values()) + 1, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.session.close()
+
+    async def post(self, url, read, **options):
+        # read gets the response once it is known to be a 200; connection failures are raised
+        # as OSError so the scheduler retries them like the requests ones
+        try:
+            async with self.session.post(url, **options) as response:
+                if response.status != 200:
+                    raise ResponseError(response, await response.text())
+                return await read(response)
+        except self.errors as e:
+            raise OSError(type(e).__name__ + ": " + str(e)) from e
+
+    async def token(self, api_key):
+        url = self.settings["iam_url"]
+        async with self.token_lock:
+            token = self.tokens.cached(api_key, url)
+            if token is None:
+                result = await self.post(url + "/identity/token", lambda response: response.json(), headers=TOKEN_HEADERS, data=token_request(api_key), ssl=False)
+                token = self.tokens.store(api_key, url, result)
+            return token
+
+    async def generate(self, body, record=None):
+        # returns the generated text, the way services.generate_text is used
+        async def request():
+            headers = {
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+                "Authorization": "Bearer: " + await self.token(self.settings["api_key"])
+            }
+
+            async def read(response):
+                data = await response.read()
+                if record is not None:
+                    record["bytes_received"] += len(data)
+                return json.loads(data)["results"][0]["generated_text"]
+
+            return await self.post(self.settings["watsonx_url"] + GENERATION_PATH, read, headers=headers, json=body)
+
+        return await self.schedulers["watsonx"].call(request, record=record)
+
+    async def synthesize(self, text, voice, accept, workspace, name, record=None):
+        # streams the audio into the workspace entry name and returns its size
+        async def request():
+            headers = {
+                "Accept": accept,
+                "Content-Type": "application/json",
+                "Authorization": "Bearer " + await self.token(self.settings["tts_api_key"])
+            }
+
+            async def read(response):
+                with workspace.create(name) as output:
+                    async for block in response.content.iter_chunked(BLOCK_SIZE):
+                        output.write(block)
+                size = workspace.size(name)
+                if not size:
+                    workspace.remove(name)
+                    raise OSError("Empty audio response")
+                return size
+
+            return await self.post(self.settings["tts_url"] + "/v1/synthesize", read, headers=headers, params={"voice": voice}, json={"text": text})
+
+        return await self.schedulers["tts"].call(request, record=record)
+
+    async def recognize(self, audio_file, content_type, record=None):
+        # uploads the open file from its start on every attempt and returns the result; the
+        # file is sent in blocks from a generator because aiohttp closes file payloads
+        async def blocks():
+            while True:
+                block = audio_file.read(BLOCK_SIZE)
+                if not block:
+                    return
+                yield block
+
+        async def request():
+            headers = {
+                "Content-Type": content_type,
+                "Accept": "application/json",
+                "Authorization": "Bearer " + await self.token(self.settings["stt_api_key"])
+            }
+            audio_file.seek(0)
+            params = {"model": STT_MODEL, "timestamps": "true"}
+            return await self.post(self.settings["stt_url"] + "/v1/recognize", lambda response: response.json(), headers=headers, params=params, data=blocks())
+
+        return await self.schedulers["stt"].call(request, record=record)
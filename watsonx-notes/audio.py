@@ -0,0 +1,336 @@
+import io
+import os
+import shutil
+import struct
+import subprocess
+import sys
+from array import array
+
+# MPEG audio layer III tables, indexed by the header fields
+MP3_BITRATES = {
+    "1": [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    "2": [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+MP3_SAMPLE_RATES = {
+    "1": [44100, 48000, 32000],
+    "2": [22050, 24000, 16000],
+    "2.5": [11025, 12000, 8000]
+}
+MP3_VERSIONS = {0: "2.5", 2: "2", 3: "1"}
+# sample rate recordings are decoded at to look for silences
+SCAN_RATE = 8000
+# entries a single ID3 table of contents can list
+TOC_ENTRIES = 255
+
+
+class Mp3FormatError(Exception):
+    pass
+
+
+def parse_mp3_header(data, pos):
+    # returns (frame length, format) for a layer III frame header at pos, or None
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    header = int.from_bytes(data[pos:pos + 4], "big")
+    version = MP3_VERSIONS.get((header >> 19) & 3)
+    layer = (header >> 17) & 3
+    bitrate_index = (header >> 12) & 15
+    rate_index = (header >> 10) & 3
+    if version is None or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = MP3_BITRATES["1" if version == "1" else "2"][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = (header >> 9) & 1
+    channel_mode = (header >> 6) & 3
+    length = (144 if version == "1" else 72) * bitrate // sample_rate + padding
+    return length, (version, sample_rate, channel_mode == 3)
+
+
+def is_info_frame(frame, fmt):
+    # Xing/Info/VBRI frames only describe the file they came from, so they are dropped
+    version, _, mono = fmt
+    protection = 0 if frame[1] & 1 else 2
+    if version == "1":
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    offset = 4 + protection + side_info
+    return frame[offset:offset + 4] in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+
+
+def id3_size(header):
+    # length of the ID3v2 tag that starts with the 10 byte header, 0 if there is none
+    if header[:3] != b"ID3" or len(header) < 10:
+        return 0
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    return 10 + size + (10 if header[5] & 0x10 else 0)
+
+
+def iter_mp3_frames(data):
+    pos = id3_size(data[:10])
+
+    while pos < len(data):
+        if data[pos:pos + 3] == b"TAG" and len(data) - pos == 128:
+            return
+        parsed = parse_mp3_header(data, pos)
+        if parsed is None:
+            raise Mp3FormatError("Invalid MP3 frame at byte " + str(pos))
+        length, fmt = parsed
+        if pos + length > len(data):
+            # truncated final frame
+            return
+        frame = data[pos:pos + length]
+        if not is_info_frame(frame, fmt):
+            yield frame, fmt
+        pos += length
+
+
+def mp3_duration(path):
+    # playback length in ms, counted from the frames rather than decoded
+    with open(path, "rb") as f:
+        data = f.read()
+    duration = 0
+    for frame, (version, sample_rate, _) in iter_mp3_frames(data):
+        duration += (1152 if version == "1" else 576) * 1000 / sample_rate
+    return round(duration)
+
+
+def silent_mp3(duration, sample_rate, mono):
+    from pydub import AudioSegment
+
+    silence = AudioSegment.silent(duration=duration, frame_rate=sample_rate).set_channels(1 if mono else 2)
+    buffer = io.BytesIO()
+    silence.export(buffer, format="mp3")
+    return buffer.getvalue()
+
+
+def open_file(path):
+    return open(path, "rb")
+
+
+class Mp3Appender:
+    # frame-level concatenation: each segment is copied through once without decoding,
+    # which only works when all of them share the MPEG version, sample rate and channels.
+    # opener turns a segment's source into a binary file, by default sources are paths
+    def __init__(self, output_path, lead_in=100, opener=open_file):
+        self.output = open(output_path, "wb")
+        self.lead_in = lead_in
+        self.opener = opener
+        self.format = None
+
+    def append(self, num, source):
+        with self.opener(source) as f:
+            data = f.read()
+        for frame, fmt in iter_mp3_frames(data):
+            if self.format is None:
+                self.format = fmt
+                if self.lead_in:
+                    for silent_frame, silent_fmt in iter_mp3_frames(silent_mp3(self.lead_in, fmt[1], fmt[2])):
+                        if silent_fmt != fmt:
+                            raise Mp3FormatError("Lead-in silence does not match segment format")
+                        self.output.write(silent_frame)
+            elif fmt != self.format:
+                raise Mp3FormatError("Segment " + str(num + 1) + " has a different format")
+            self.output.write(frame)
+
+    def close(self):
+        self.output.close()
+        if self.format is None:
+            raise Mp3FormatError("No MP3 frames found")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.output.close()
+
+
+def join_mp3_frames(segments, output_path, lead_in=100, opener=open_file):
+    with Mp3Appender(output_path, lead_in, opener) as appender:
+        for num, source in segments:
+            appender.append(num, source)
+
+
+def stream_encode(segments, output_path, lead_in=100, opener=open_file):
+    # decode one segment at a time and pipe the PCM into a single encoder process, so
+    # memory holds at most one segment no matter how long the narration is
+    from pydub import AudioSegment
+
+    failures = {}
+    encoder = None
+    frame_rate = channels = None
+
+    try:
+        for num, source in segments:
+            try:
+                with opener(source) as f:
+                    segment = AudioSegment.from_file(f, format="mp3")
+            except Exception as e:
+                failures[num] = str(e)
+                continue
+
+            if encoder is None:
+                frame_rate, channels = segment.frame_rate, segment.channels
+                encoder = subprocess.Popen(
+                    [AudioSegment.converter, "-y", "-f", "s16le", "-ar", str(frame_rate), "-ac", str(channels),
+                     "-i", "pipe:0", "-f", "mp3", output_path],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+                silence = AudioSegment.silent(duration=lead_in, frame_rate=frame_rate)
+                encoder.stdin.write(silence.set_channels(channels).set_sample_width(2).raw_data)
+
+            segment = segment.set_frame_rate(frame_rate).set_channels(channels).set_sample_width(2)
+            encoder.stdin.write(segment.raw_data)
+    finally:
+        if encoder is not None:
+            encoder.stdin.close()
+            encoder.wait()
+
+    if encoder is None:
+        AudioSegment.silent(duration=lead_in).export(output_path, format="mp3")
+    elif encoder.returncode != 0:
+        raise Exception("ffmpeg exited with status " + str(encoder.returncode))
+
+    return failures
+
+
+def assemble_mp3(segments, output_path, lead_in=100, opener=open_file):
+    # segments is a list of (chunk number, mp3 source) in playback order; returns the
+    # chunks that could not be decoded
+    try:
+        join_mp3_frames(segments, output_path, lead_in, opener)
+        return {}
+    except Mp3FormatError:
+        return stream_encode(segments, output_path, lead_in, opener)
+
+
+def scan_audio(path, window=50):
+    # decode the recording through ffmpeg as low rate mono PCM, one window at a time, so
+    # memory does not grow with the recording; returns the duration in ms and the mean
+    # square level of every window
+    from pydub import AudioSegment
+
+    process = subprocess.Popen(
+        [AudioSegment.converter, "-v", "error", "-i", path, "-vn", "-ac", "1", "-ar", str(SCAN_RATE), "-f", "s16le", "pipe:1"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    block = SCAN_RATE * window // 1000 * 2
+    levels = array("d")
+    samples = 0
+    try:
+        while True:
+            data = process.stdout.read(block)
+            if len(data) < 2:
+                break
+            pcm = array("h", data[:len(data) // 2 * 2])
+            if sys.byteorder == "big":
+                pcm.byteswap()
+            levels.append(sum(sample * sample for sample in pcm) / len(pcm))
+            samples += len(pcm)
+    finally:
+        process.stdout.close()
+        process.wait()
+    if process.returncode != 0:
+        raise Exception("ffmpeg exited with status " + str(process.returncode))
+    return samples * 1000 // SCAN_RATE, levels
+
+
+def silence_points(levels, window=50, min_silence=300, threshold=16):
+    # midpoints (ms) of every quiet stretch of at least min_silence ms; a window is quiet
+    # when it is threshold dB below the recording's overall level
+    if not levels:
+        return []
+    quiet_level = sum(levels) / len(levels) * 10 ** (-threshold / 10)
+    points = []
+    quiet_start = None
+    for num, level in enumerate(levels):
+        start = num * window
+        if level < quiet_level:
+            if quiet_start is None:
+                quiet_start = start
+        else:
+            if quiet_start is not None and start - quiet_start >= min_silence:
+                points.append((quiet_start + start) // 2)
+            quiet_start = None
+    return points
+
+
+def split_at_silences(duration, silences, segment_length, overlap, search=30000):
+    # returns (start, end, core start, core end) in ms for each segment; segments are cut at
+    # the silence nearest each multiple of segment_length and padded by overlap on both
+    # sides, so a word cut at a boundary is heard whole by at least one segment
+    bounds = [0]
+    while duration - bounds[-1] > segment_length + search:
+        goal = bounds[-1] + segment_length
+        candidates = [point for point in silences if goal - search <= point <= goal + search]
+        bounds.append(min(candidates, key=lambda point: abs(point - goal)) if candidates else goal)
+    bounds.append(duration)
+
+    return [(max(0, core_start - overlap), min(duration, core_end + overlap), core_start, core_end)
+            for core_start, core_end in zip(bounds, bounds[1:])]
+
+
+def extract_segment(path, start, end, output_path, options=("-f", "mp3")):
+    # cut start to end (ms) of the first audio track out of any file ffmpeg can read, without
+    # decoding the rest of the recording or touching its video; options set the encoding
+    from pydub import AudioSegment
+
+    result = subprocess.run(
+        [AudioSegment.converter, "-v", "error", "-y", "-ss", str(start / 1000), "-t", str((end - start) / 1000),
+         "-i", path, "-map", "0:a:0", "-vn", "-sn", "-dn"] + list(options) + [output_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise Exception("ffmpeg exited with status " + str(result.returncode) + ": " + result.stderr.decode("utf-8", "replace").strip())
+
+
+def id3_frame(frame_id, body):
+    return frame_id.encode("latin-1") + struct.pack(">IH", len(body), 0) + body
+
+
+def id3_toc(element, flags, children):
+    return id3_frame("CTOC", element + b"\0" + bytes([flags, len(children)]) + b"".join(child + b"\0" for child in children))
+
+
+def chapter_tag(chapters):
+    # an ID3v2.3 tag with a CHAP frame for every (title, start ms, end ms) and an ordered
+    # table of contents; longer lists go into nested tables of TOC_ENTRIES each
+    frames = b""
+    elements = []
+    for num, (title, start, end) in enumerate(chapters):
+        element = b"chp" + str(num).encode("latin-1")
+        elements.append(element)
+        title_frame = id3_frame("TIT2", b"\0" + title.encode("latin-1", "replace"))
+        frames += id3_frame("CHAP", element + b"\0" + struct.pack(">IIII", start, end, 0xFFFFFFFF, 0xFFFFFFFF) + title_frame)
+
+    if len(elements) <= TOC_ENTRIES:
+        # top level and ordered
+        frames = id3_toc(b"toc", 3, elements) + frames
+    else:
+        parts = [elements[start:start + TOC_ENTRIES] for start in range(0, len(elements), TOC_ENTRIES)]
+        names = [b"toc" + str(num + 1).encode("latin-1") for num in range(len(parts))]
+        frames = id3_toc(b"toc", 3, names) + b"".join(id3_toc(name, 1, part) for name, part in zip(names, parts)) + frames
+
+    size = len(frames)
+    return b"ID3\3\0\0" + bytes([(size >> 21) & 127, (size >> 14) & 127, (size >> 7) & 127, size & 127]) + frames
+
+
+def add_chapters(path, chapters):
+    # put the chapters in front of the MP3 at path, replacing the ID3v2 tag it starts with
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(path, "rb") as source, open(temp_path, "wb") as output:
+            source.seek(id3_size(source.read(10)))
+            output.write(chapter_tag(chapters))
+            shutil.copyfileobj(source, output)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,130 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from generation import audio_status, generate_audio, generate_notes, job_metrics, load_settings, notes_status
+
+DEFAULT_VOICE = "en-US_AllisonV3Voice"
+DEFAULT_JOBS = 4
+
+
+def expand(patterns):
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def job_directory(output_root, kind, path, used):
+    name = os.path.splitext(os.path.basename(path))[0]
+    directory = os.path.join(output_root, kind, name)
+    count = 2
+    while directory in used:
+        directory = os.path.join(output_root, kind, name + "-" + str(count))
+        count += 1
+    used.add(directory)
+    return directory
+
+
+def run_job(kind, path, directory, settings, voice, pipeline, stream, slide_files=False):
+    os.makedirs(directory, exist_ok=True)
+    started = time.time()
+    summary = {
+        "kind": kind,
+        "input": path,
+        "output_dir": directory,
+        "started": started
+    }
+
+    def on_status(text, percent):
+        summary["last_status"] = text
+
+    # each job keeps its own timing log next to its output
+    settings = dict(settings, metrics_file=os.path.join(directory, "metrics.jsonl"))
+    metrics = job_metrics(settings, kind)
+
+    try:
+        if kind == "notes":
+            failures = generate_notes(settings, path, os.path.join(directory, "notes_output.txt"), on_status, metrics)
+            summary["status"] = "partial" if failures else "ok"
+            summary["message"] = notes_status(failures)
+            summary["segment_failures"] = failures
+        else:
+            result = generate_audio(settings, path, voice, directory, on_status, pipeline, stream, metrics, slide_files)
+            summary["status"] = "partial" if result["audio_failures"] or result["script_failures"] else "ok"
+            summary["message"] = audio_status(result)
+            summary.update(result)
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = str(e)
+
+    summary["seconds"] = round(time.time() - started, 3)
+    summary["stages"] = metrics.summary()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate speaker audio and notes without the GUI.")
+    parser.add_argument("--decks", nargs="*", default=[], help="glob patterns of ppt, pptx or txt files to narrate")
+    parser.add_argument("--recordings", nargs="*", default=[], help="glob patterns of mp3 or mp4 recordings to turn into notes")
+    parser.add_argument("--settings", default="settings.json", help="settings file saved by the app")
+    parser.add_argument("--voice", default=DEFAULT_VOICE, help="text to speech voice")
+    parser.add_argument("--output", default="batch_output", help="directory that receives one folder per job")
+    parser.add_argument("--summary", help="summary file, defaults to summary.json in the output directory")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="number of jobs run at the same time")
+    parser.add_argument("--threads", action="store_true", help="run jobs on threads instead of processes")
+    parser.add_argument("--pipeline", action="store_true", help="script and narrate PowerPoint files slide by slide, reusing the slides that did not change")
+    parser.add_argument("--stream", action="store_true", help="synthesize the script while watsonx.ai is still generating it")
+    parser.add_argument("--slide-files", action="store_true", help="also write the audio of every PowerPoint slide, chapter markers and an index of the slide times; implies --pipeline for PowerPoint files")
+    parser.add_argument("--fresh", action="store_true", help="ignore cached watsonx.ai output and generate it again")
+    parser.add_argument("--async-engine", action="store_true", help="send each job's requests from one asyncio event loop; the worker settings become the requests in flight per service")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.settings):
+        parser.error("settings file " + args.settings + " not found, save your settings from the app first")
+    settings = load_settings(args.settings)
+    if args.fresh:
+        settings["llm_cache"] = False
+    if args.async_engine:
+        settings["async_engine"] = True
+
+    used = set()
+    jobs = [("audio", path, job_directory(args.output, "audio", path, used)) for path in expand(args.decks)]
+    jobs += [("notes", path, job_directory(args.output, "notes", path, used)) for path in expand(args.recordings)]
+    if not jobs:
+        parser.error("no input files matched")
+
+    started = time.time()
+    results = []
+    pool = ThreadPoolExecutor if args.threads else ProcessPoolExecutor
+    with pool(max_workers=max(1, args.jobs)) as executor:
+        futures = [executor.submit(run_job, kind, path, directory, settings, args.voice, args.pipeline, args.stream, args.slide_files) for kind, path, directory in jobs]
+        for completed, future in enumerate(as_completed(futures)):
+            result = future.result()
+            results.append(result)
+            print("[" + str(completed + 1) + "/" + str(len(jobs)) + "] " + result["status"] + " " + result["input"] + " (" + str(result["seconds"]) + "s)")
+
+    summary = {
+        "started": started,
+        "seconds": round(time.time() - started, 3),
+        "succeeded": sum(1 for result in results if result["status"] == "ok"),
+        "partial": sum(1 for result in results if result["status"] == "partial"),
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+        "jobs": sorted(results, key=lambda result: (result["kind"], result["input"]))
+    }
+
+    summary_path = args.summary or os.path.join(args.output, "summary.json")
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_services import AsyncServices
+from fakes import start_fakes
+from generation import DEFAULT_SETTINGS, DEFAULT_TTS_WORKERS, TTS_MAX_BYTES, clean, get_chunks, split_sentences, synthesize_chunks_async
+from workspace import Workspace
+
+VOICE = "en-US_AllisonV3Voice"
+
+WORDS = ["watsonx", "data", "model", "the", "governance", "lakehouse", "query", "engine", "an", "open",
+         "format", "scales", "with", "workloads", "while", "keeping", "costs", "predictable", "and", "secure"]
+
+
+def legacy_chunks(s, maxlength=400):
+    # the splitter used before the byte budget chunker, kept here for comparison
+    start = 0
+    end = 0
+    while start + maxlength < len(s) and end != -1:
+        end = s.rfind(" ", start, start + maxlength + 1)
+        yield s[start:end]
+        start = end + 1
+    yield s[start:]
+
+
+def sample_script(slides, seed=1):
+    generator = random.Random(seed)
+    text = ""
+    for slide in range(slides):
+        text += "\n\nSlide " + str(slide + 1) + ":\n"
+        for _ in range(generator.randint(4, 12)):
+            words = generator.choices(WORDS, k=generator.randint(8, 24))
+            text += " ".join(words).capitalize() + ". "
+    return text
+
+
+def mid_sentence_splits(chunks):
+    return sum(1 for chunk in chunks[:-1] if chunk.strip() and chunk.strip()[-1] not in ".!?\"')]")
+
+
+def synthesis_seconds(chunks, settings, workers):
+    # synthesize the chunks against the fake text to speech service, workers at a time
+    async def synthesize():
+        async with AsyncServices(settings, {"tts": workers}) as services:
+            with Workspace() as workspace:
+                return await synthesize_chunks_async(services, chunks, VOICE, lambda completed, total, fraction: None, workspace)
+
+    started = time.perf_counter()
+    failures = asyncio.run(synthesize())
+    if failures:
+        raise Exception("Synthesis failed: " + str(failures))
+    return time.perf_counter() - started
+
+
+def report(name, chunks, settings, workers):
+    sizes = [len(clean(chunk).encode("utf-8")) for chunk in chunks]
+    print(name)
+    print("  requests:            " + str(len(chunks)))
+    print("  largest request:     " + str(max(sizes)) + " bytes")
+    print("  mid-sentence splits: " + str(mid_sentence_splits(chunks)))
+    print("  synthesis:           " + str(round(synthesis_seconds(chunks, settings, workers), 1)) + " s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the TTS requests and synthesis time of the old 400 character splitter and the sentence chunker.")
+    parser.add_argument("--script", help="script file to chunk, defaults to a generated deck script")
+    parser.add_argument("--slides", type=int, default=40, help="slides in the generated script")
+    parser.add_argument("--max-bytes", type=int, default=TTS_MAX_BYTES, help="byte budget for the sentence chunker")
+    parser.add_argument("--latency", type=float, default=0.6, help="seconds of overhead per request to the fake TTS service")
+    parser.add_argument("--bytes-per-second", type=float, default=2000, help="text bytes the fake TTS service synthesizes per second")
+    parser.add_argument("--workers", type=int, default=DEFAULT_TTS_WORKERS, help="TTS requests in flight at once")
+    args = parser.parse_args()
+
+    if args.script:
+        with open(args.script, "r") as f:
+            script = f.read()
+    else:
+        script = sample_script(args.slides)
+
+    services, fake_settings = start_fakes(latency=args.latency, char_seconds=1 / args.bytes_per_second)
+    settings = dict(DEFAULT_SETTINGS, **fake_settings)
+    try:
+        print("script: " + str(len(script.encode("utf-8"))) + " bytes, " + str(len(split_sentences(script))) + " sentences")
+        report("400 character splitter", list(legacy_chunks(script)), settings, args.workers)
+        report("sentence chunker (" + str(args.max_bytes) + " bytes)", get_chunks(script, args.max_bytes), settings, args.workers)
+    finally:
+        for service in services.values():
+            service.stop()
+
+
+if __name__ == "__main__":
+    main()
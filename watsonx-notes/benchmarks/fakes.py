@@ -0,0 +1,310 @@
+import abc
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio import Mp3FormatError, iter_mp3_frames
+
+WORDS = ["watsonx", "data", "model", "the", "governance", "lakehouse", "query", "engine", "an", "open",
+         "format", "scales", "with", "workloads", "while", "keeping", "costs", "predictable", "and", "secure"]
+
+# the fake speech is a tone at 459 Hz, a whole number of cycles per 1152 sample frame at
+# 44.1 kHz, so its frames can be repeated without clicks; loud enough that post-processing
+# keeps all of it
+TONE_HZ = 44100 / 1152 * 12
+TONE_DBFS = -18
+
+
+class FakeService(abc.ABC):
+    # a local stand-in for one IBM Cloud service: every request waits latency seconds (plus
+    # up to jitter more), and error_rate of them are answered with a 429 or 503 instead.
+    # Subclasses answer the requests that get through in respond
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, retry_after=0.1, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.active = 0
+        self.peak_active = 0
+        self.server = None
+
+    def start(self, port=0):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    service.send(self, 200, "application/json", json.dumps(service.stats()).encode())
+                else:
+                    service.send(self, 404, "text/plain", b"not found")
+
+            def do_POST(self):
+                service.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:" + str(self.server.server_address[1])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler):
+        started = time.perf_counter()
+        body = read_body(handler)
+        with self.lock:
+            self.requests += 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            failed = self.random.random() < self.error_rate
+            code = 429 if self.requests % 2 else 503
+            delay = self.latency + self.random.random() * self.jitter
+        try:
+            time.sleep(delay)
+            if failed:
+                with self.lock:
+                    self.errors += 1
+                self.send(handler, code, "application/json", json.dumps({"error": "fake overload"}).encode(), {"Retry-After": str(self.retry_after)})
+            else:
+                self.respond(handler, urlparse(handler.path), body)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.busy += time.perf_counter() - started
+
+    @abc.abstractmethod
+    def respond(self, handler, url, body):
+        pass
+
+    def send(self, handler, code, content_type, data, headers=None):
+        handler.send_response(code)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "busy_seconds": round(self.busy, 3),
+                "peak_concurrency": self.peak_active
+            }
+
+
+def read_body(handler):
+    # uploads streamed from a generator arrive chunked instead of with a Content-Length
+    if handler.headers.get("Transfer-Encoding", "").lower() != "chunked":
+        return handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+    body = b""
+    while True:
+        size = int(handler.rfile.readline().split(b";")[0], 16)
+        if not size:
+            while handler.rfile.readline().strip():
+                pass
+            return body
+        body += handler.rfile.read(size)
+        handler.rfile.readline()
+
+
+def fake_jwt(expires_in):
+    def encode(value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).rstrip(b"=").decode()
+
+    now = int(time.time())
+    return encode({"alg": "RS256", "typ": "JWT"}) + "." + encode({"iat": now, "exp": now + expires_in}) + ".c2ln"
+
+
+class FakeIam(FakeService):
+    def __init__(self, expires_in=3600, **options):
+        super().__init__(**options)
+        self.expires_in = expires_in
+
+    def respond(self, handler, url, body):
+        result = {
+            "access_token": fake_jwt(self.expires_in),
+            "refresh_token": "fake",
+            "token_type": "Bearer",
+            "expires_in": self.expires_in,
+            "expiration": int(time.time()) + self.expires_in
+        }
+        self.send(handler, 200, "application/json", json.dumps(result).encode())
+
+
+class FakeWatsonx(FakeService):
+    # answers text generation with about output_ratio words per word of input, split into
+    # paragraphs of paragraph_sentences; the streaming endpoint sends one word per event
+    def __init__(self, output_ratio=1.0, paragraph_sentences=6, token_seconds=0.002, **options):
+        super().__init__(**options)
+        self.output_ratio = output_ratio
+        self.paragraph_sentences = paragraph_sentences
+        self.token_seconds = token_seconds
+
+    def generated(self, body):
+        request = json.loads(body or b"{}")
+        words = max(1, int(len(request.get("input", "").split()) * self.output_ratio))
+        generator = random.Random(words)
+        text = ""
+        sentences = 0
+        while words > 0:
+            length = min(words, generator.randint(8, 24))
+            text += " ".join(generator.choices(WORDS, k=length)).capitalize() + "."
+            words -= length
+            sentences += 1
+            text += "\n\n" if sentences % self.paragraph_sentences == 0 else " "
+        return text.strip()
+
+    def respond(self, handler, url, body):
+        text = self.generated(body)
+        if url.path.endswith("/generation_stream"):
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/event-stream")
+            handler.send_header("Connection", "close")
+            handler.end_headers()
+            pieces = text.split(" ")
+            for num, word in enumerate(pieces):
+                piece = word if num == len(pieces) - 1 else word + " "
+                event = {"results": [{"generated_text": piece, "generated_token_count": num + 1}]}
+                handler.wfile.write(b"id: " + str(num + 1).encode() + b"\nevent: message\ndata: " + json.dumps(event).encode() + b"\n\n")
+                handler.wfile.flush()
+                time.sleep(self.token_seconds)
+            handler.close_connection = True
+            return
+
+        time.sleep(self.token_seconds * len(text.split()))
+        result = {"results": [{"generated_text": text, "generated_token_count": len(text.split()), "stop_reason": "eos_token"}]}
+        self.send(handler, 200, "application/json", json.dumps(result).encode())
+
+
+def tone_frames(seconds=2):
+    # MP3 frames of the tone at 128 kbps and 44.1 kHz, about 26 ms each; they are encoded
+    # without the bit reservoir so any run of them decodes on its own, and the encoder's
+    # delay and padding frames at both ends are left out
+    import io
+    from pydub.generators import Sine
+
+    buffer = io.BytesIO()
+    Sine(TONE_HZ).to_audio_segment(seconds * 1000, volume=TONE_DBFS).set_frame_rate(44100).export(
+        buffer, format="mp3", bitrate="128k", parameters=["-reservoir", "0"])
+    return [frame for frame, fmt in iter_mp3_frames(buffer.getvalue())][2:-2]
+
+
+class FakeTextToSpeech(FakeService):
+    # returns MP3 frames of a tone, frames_per_char of them per character of text, after
+    # char_seconds of synthesis per character
+    def __init__(self, frames_per_char=2.5, char_seconds=0.0, **options):
+        super().__init__(**options)
+        self.frames_per_char = frames_per_char
+        self.char_seconds = char_seconds
+        self.frames = tone_frames()
+
+    def respond(self, handler, url, body):
+        text = json.loads(body or b"{}").get("text", "")
+        time.sleep(len(text) * self.char_seconds)
+        count = max(1, math.ceil(len(text) * self.frames_per_char))
+        self.send(handler, 200, "audio/mp3", b"".join(self.frames[num % len(self.frames)] for num in range(count)))
+
+
+class FakeSpeechToText(FakeService):
+    # "recognizes" words_per_second evenly spaced words over the length of the MP3 it is sent
+    def __init__(self, words_per_second=2.5, **options):
+        super().__init__(**options)
+        self.words_per_second = words_per_second
+
+    def respond(self, handler, url, body):
+        try:
+            seconds = sum((1152 if version == "1" else 576) / rate for _, (version, rate, _) in iter_mp3_frames(body))
+        except Mp3FormatError:
+            seconds = len(body) / 16000
+        generator = random.Random(len(body))
+        step = 1 / self.words_per_second
+        timestamps = []
+        start = 0.0
+        while start + step <= seconds:
+            timestamps.append([generator.choice(WORDS), round(start, 2), round(start + step * .8, 2)])
+            start += step
+        alternative = {"transcript": " ".join(word for word, _, _ in timestamps), "confidence": 0.9}
+        if "timestamps=true" in url.query or parse_qs(url.query).get("timestamps") == ["true"]:
+            alternative["timestamps"] = timestamps
+        result = {"result_index": 0, "results": [{"alternatives": [alternative], "final": True}]}
+        self.send(handler, 200, "application/json", json.dumps(result).encode())
+
+
+def start_fakes(latency=0.05, error_rate=0.0, token_seconds=0.002, frames_per_char=2.5, words_per_second=2.5, output_ratio=1.0, port=0, char_seconds=0.0):
+    # returns the running services and the settings that point the app at them
+    options = {"latency": latency, "error_rate": error_rate}
+    services = {
+        "iam": FakeIam(**dict(options, error_rate=0.0)),
+        "watsonx": FakeWatsonx(output_ratio=output_ratio, token_seconds=token_seconds, **options),
+        "tts": FakeTextToSpeech(frames_per_char=frames_per_char, char_seconds=char_seconds, **options),
+        "stt": FakeSpeechToText(words_per_second=words_per_second, **options)
+    }
+    urls = {name: service.start(port + num if port else 0) for num, (name, service) in enumerate(services.items())}
+    settings = {
+        "api_key": "fake",
+        "stt_api_key": "fake",
+        "tts_api_key": "fake",
+        "notes_prompt": "fake-project",
+        "audio_prompt": "fake-project",
+        "iam_url": urls["iam"],
+        "watsonx_url": urls["watsonx"],
+        "tts_url": urls["tts"],
+        "stt_url": urls["stt"]
+    }
+    return services, settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local stand-ins for the IAM, watsonx.ai, TTS and STT services.")
+    parser.add_argument("--port", type=int, default=0, help="first of four consecutive ports, random ports by default")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fixed delay added to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429 or 503")
+    parser.add_argument("--token-ms", type=float, default=2, help="generation time per word of watsonx.ai output")
+    parser.add_argument("--frames-per-char", type=float, default=2.5, help="MP3 frames of TTS audio per character")
+    parser.add_argument("--char-ms", type=float, default=0.0, help="TTS synthesis time per character")
+    parser.add_argument("--words-per-second", type=float, default=2.5, help="words STT recognizes per second of audio")
+    parser.add_argument("--output-ratio", type=float, default=1.0, help="words of watsonx.ai output per word of input")
+    parser.add_argument("--settings", help="also write a settings file that points the app at the stand-ins")
+    args = parser.parse_args()
+
+    services, settings = start_fakes(args.latency_ms / 1000, args.error_rate, args.token_ms / 1000, args.frames_per_char,
+                                     args.words_per_second, args.output_ratio, args.port, args.char_ms / 1000)
+    if args.settings:
+        with open(args.settings, "w") as f:
+            json.dump(settings, f, indent=2)
+    print(json.dumps(settings), flush=True)
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for service in services.values():
+            service.stop()
+
+
+if __name__ == "__main__":
+    main()
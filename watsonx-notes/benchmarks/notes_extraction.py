@@ -0,0 +1,106 @@
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import sample_script
+from pptx_notes import read_notes
+
+
+def noise_png(width, height, seed):
+    # an incompressible RGB image, so every slide carries about width * height * 3 bytes of media
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    generator = random.Random(seed)
+    rows = b"".join(b"\x00" + generator.randbytes(width * 3) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 1)) + chunk(b"IEND", b""))
+
+
+def write_deck(path, slides, media_kb, notes_every):
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    deck = Presentation()
+    side = max(1, int((media_kb * 1024 / 3) ** 0.5))
+    image_path = path + ".png"
+    notes = sample_script(slides).split("\n\nSlide ")[1:]
+    for num in range(slides):
+        slide = deck.slides.add_slide(deck.slide_layouts[5])
+        slide.shapes.title.text = "Slide " + str(num + 1)
+        if media_kb:
+            with open(image_path, "wb") as f:
+                f.write(noise_png(side, side, num))
+            slide.shapes.add_picture(image_path, Inches(1), Inches(1.5))
+        # leave some slides without a notes slide at all
+        if num % notes_every == 0:
+            slide.notes_slide.notes_text_frame.text = notes[num].split(":\n", 1)[1]
+    deck.save(path)
+    if media_kb:
+        os.remove(image_path)
+
+
+def python_pptx_notes(path):
+    # the extractor used before, kept here for comparison
+    from pptx import Presentation
+
+    ppt = Presentation(path)
+    return [slide.notes_slide.notes_text_frame.text for slide in ppt.slides]
+
+
+def measure(name, extract, path, runs):
+    seconds = []
+    peak = 0
+    for _ in range(runs):
+        tracemalloc.start()
+        started = time.perf_counter()
+        notes = extract(path)
+        seconds.append(time.perf_counter() - started)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    print(name)
+    print("  best time:     " + str(round(min(seconds) * 1000, 1)) + " ms")
+    print("  peak memory:   " + str(round(peak / 1024 / 1024, 1)) + " MB")
+    print("  slides:        " + str(len(notes)) + ", " + str(sum(1 for text in notes if text)) + " with notes")
+    return notes, min(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare reading speaker notes through python-pptx and the zip extractor.")
+    parser.add_argument("--deck", help="pptx file to read, defaults to a generated deck")
+    parser.add_argument("--slides", type=int, default=300, help="slides in the generated deck")
+    parser.add_argument("--media-kb", type=int, default=500, help="size of the image on every generated slide")
+    parser.add_argument("--notes-every", type=int, default=1, help="give every nth generated slide notes")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs of each extractor")
+    args = parser.parse_args()
+
+    # python-pptx is imported once up front so its import time is not counted
+    import pptx
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.deck
+        if not path:
+            path = os.path.join(directory, "deck.pptx")
+            write_deck(path, args.slides, args.media_kb, args.notes_every)
+        print("deck: " + str(round(os.path.getsize(path) / 1024 / 1024, 1)) + " MB")
+
+        expected, baseline = measure("python-pptx", python_pptx_notes, path, args.runs)
+        notes, seconds = measure("zip extractor", read_notes, path, args.runs)
+
+    print("speedup: " + str(round(baseline / seconds, 1)) + "x")
+    if notes != expected:
+        different = [str(num + 1) for num, (a, b) in enumerate(zip(notes, expected)) if a != b]
+        print("notes differ on slide(s) " + ", ".join(different) if different else "slide counts differ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
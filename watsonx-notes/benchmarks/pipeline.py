@@ -0,0 +1,211 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from chunking import sample_script
+from generation import DEFAULT_SETTINGS, generate_audio, generate_notes
+from metrics import Metrics
+
+SERVICES = ["iam", "watsonx", "tts", "stt"]
+SETTINGS_URLS = {"iam": "iam_url", "watsonx": "watsonx_url", "tts": "tts_url", "stt": "stt_url"}
+SAMPLE_SECONDS = 0.05
+
+
+def start_fakes(args):
+    # the stand-ins run in their own process so the peak RSS below is the pipeline's alone
+    command = [sys.executable, os.path.join(APP_DIR, "benchmarks", "fakes.py"),
+               "--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate), "--token-ms", str(args.token_ms)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return process, json.loads(process.stdout.readline())
+
+
+def service_stats(settings):
+    stats = {}
+    for name in SERVICES:
+        with urllib.request.urlopen(settings[SETTINGS_URLS[name]] + "/stats") as response:
+            stats[name] = json.load(response)
+    return stats
+
+
+def write_deck(directory, slides, pptx):
+    script = sample_script(slides)
+    if not pptx:
+        path = os.path.join(directory, "deck.txt")
+        with open(path, "w") as f:
+            f.write(script)
+        return path
+
+    from pptx import Presentation
+
+    deck = Presentation()
+    for notes in script.split("\n\nSlide ")[1:]:
+        slide = deck.slides.add_slide(deck.slide_layouts[6])
+        slide.notes_slide.notes_text_frame.text = notes.split(":\n", 1)[1]
+    path = os.path.join(directory, "deck.pptx")
+    deck.save(path)
+    return path
+
+
+def write_recording(directory, minutes):
+    # four seconds of tone and half a second of silence, repeated, so the splitter finds pauses
+    from pydub import AudioSegment
+    from pydub.generators import Sine
+
+    phrase = Sine(220).to_audio_segment(duration=4000, volume=-20) + AudioSegment.silent(duration=500)
+    recording = phrase * max(1, int(minutes * 60 / 4.5))
+    path = os.path.join(directory, "recording.mp3")
+    recording.export(path, format="mp3")
+    return path
+
+
+def tree_rss(pid):
+    # resident bytes of a process and all of its descendants, from /proc on Linux
+    parents = {}
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open("/proc/" + name + "/stat") as f:
+                    # the parent pid follows the state, after the command name in parentheses
+                    parents[int(name)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                # the process exited while it was read
+                pass
+    tree = {pid}
+    added = True
+    while added:
+        children = set(child for child, parent in parents.items() if parent in tree) - tree
+        tree |= children
+        added = bool(children)
+
+    total = 0
+    for member in tree:
+        try:
+            with open("/proc/" + str(member) + "/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            pass
+    return total
+
+
+def sample_tree_rss(stop, peak):
+    while not stop.wait(SAMPLE_SECONDS):
+        peak[0] = max(peak[0], tree_rss(os.getpid()))
+
+
+def measure(kind, run, settings):
+    # run in a process of its own, so that the peak RSS is this pipeline's alone. The ffmpeg
+    # processes it starts report the memory they were forked with as their own, so they are
+    # counted by sampling the whole process tree instead, where /proc allows it
+    before = service_stats(settings)
+    metrics = Metrics(kind)
+    stop = threading.Event()
+    peak = [0]
+    sampler = threading.Thread(target=sample_tree_rss, args=(stop, peak), daemon=True)
+    if os.path.isdir("/proc/self"):
+        sampler.start()
+    started = time.perf_counter()
+    try:
+        result = run(lambda text, percent: None, metrics)
+    finally:
+        stop.set()
+    seconds = time.perf_counter() - started
+    if sampler.is_alive():
+        sampler.join()
+    after = service_stats(settings)
+
+    requests = {name: after[name]["requests"] - before[name]["requests"] for name in SERVICES}
+    return {
+        "kind": kind,
+        "seconds": round(seconds, 3),
+        "requests": requests,
+        "requests_per_second": round(sum(requests.values()) / seconds, 1),
+        "errors_injected": {name: after[name]["errors"] - before[name]["errors"] for name in SERVICES},
+        "peak_concurrency": {name: after[name]["peak_concurrency"] for name in SERVICES},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_tree_rss_mb": round(peak[0] / 1024 / 1024, 1) if peak[0] else None,
+        "stages": metrics.summary(),
+        "result": result
+    }
+
+
+def report(measurement):
+    print(measurement["kind"])
+    print("  wall time:        " + str(measurement["seconds"]) + " s")
+    print("  requests:         " + ", ".join(name + " " + str(count) for name, count in measurement["requests"].items() if count))
+    print("  requests/second:  " + str(measurement["requests_per_second"]))
+    print("  injected errors:  " + ", ".join(name + " " + str(count) for name, count in measurement["errors_injected"].items() if count))
+    print("  peak RSS:         " + str(measurement["peak_rss_mb"]) + " MB, " + str(measurement["peak_tree_rss_mb"]) + " MB with ffmpeg")
+    # stages that run on several threads at once can add up to more than the wall time
+    for name, totals in sorted(measurement["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        print("  " + (name + ":").ljust(18) + str(totals["seconds"]).rjust(9) + " s in " + str(totals["calls"]) + " calls, " + str(totals["retries"]) + " retries")
+
+
+def run_pipeline(kind, path, directory, settings, args):
+    # the TTS cache lives under the working directory, keep it out of the measurement
+    os.chdir(directory)
+    if kind == "audio":
+        return measure(kind, lambda on_status, metrics: generate_audio(settings, path, "en-US_AllisonV3Voice", directory, on_status, args.pipeline, args.stream, metrics), settings)
+    return measure(kind, lambda on_status, metrics: generate_notes(settings, path, os.path.join(directory, "notes.txt"), on_status, metrics), settings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the notes and audio pipelines end to end against local service stand-ins.")
+    parser.add_argument("--slides", type=int, default=40, help="slides in the generated deck")
+    parser.add_argument("--minutes", type=float, default=12, help="length of the generated recording")
+    parser.add_argument("--latency-ms", type=float, default=50, help="delay the stand-ins add to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429 or 503")
+    parser.add_argument("--token-ms", type=float, default=2, help="generation time per word of watsonx.ai output")
+    parser.add_argument("--tts-workers", type=int, default=4, help="TTS Workers setting")
+    parser.add_argument("--stt-workers", type=int, default=4, help="STT Workers setting")
+    parser.add_argument("--pipeline", action="store_true", help="narrate a pptx slide by slide, needs python-pptx")
+    parser.add_argument("--stream", action="store_true", help="stream the script into synthesis")
+    parser.add_argument("--async-engine", action="store_true", help="send the requests from one asyncio event loop, needs aiohttp")
+    parser.add_argument("--skip-notes", action="store_true", help="do not run the notes pipeline, which needs ffmpeg")
+    parser.add_argument("--skip-audio", action="store_true", help="do not run the audio pipeline")
+    parser.add_argument("--json", help="also write the measurements to this file")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    fakes, fake_settings = start_fakes(args)
+    settings = dict(DEFAULT_SETTINGS, **fake_settings)
+    settings.update({"tts_workers": str(args.tts_workers), "stt_workers": str(args.stt_workers), "llm_cache": False, "async_engine": args.async_engine})
+
+    measurements = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            # the inputs are written here, so encoding the recording is not counted either
+            jobs = []
+            if not args.skip_audio:
+                jobs.append(("audio", write_deck(directory, args.slides, args.pipeline)))
+            if not args.skip_notes:
+                jobs.append(("notes", write_recording(directory, args.minutes)))
+            # a spawned process starts without this one's memory, where a forked one would
+            # inherit its peak
+            context = multiprocessing.get_context("spawn")
+            for kind, path in jobs:
+                with context.Pool(1) as pool:
+                    measurements.append(pool.apply(run_pipeline, (kind, path, directory, settings, args)))
+    finally:
+        fakes.terminate()
+        fakes.wait()
+
+    for measurement in measurements:
+        report(measurement)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(measurements, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that should only be loaded once a generation actually needs them
+HEAVY_MODULES = ["pptx", "pydub", "ibm_watson", "ibm_cloud_sdk_core", "requests", "aiohttp", "numpy"]
+
+CHILD = """
+import json
+import sys
+import time
+import types
+
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import main
+imported = time.perf_counter()
+main.SpeakerNotesApp(types.SimpleNamespace(overlay=[], width=1200))
+built = time.perf_counter()
+
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "build_ms": (built - imported) * 1000,
+    "loaded": [name for name in sys.argv[2:] if name in sys.modules]
+}))
+"""
+
+
+def measure(runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", CHILD, APP_DIR] + HEAVY_MODULES, capture_output=True, text=True, check=True, cwd=APP_DIR).stdout
+        samples.append(json.loads(output))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the app takes to import and build its first view.")
+    parser.add_argument("--runs", type=int, default=10, help="number of fresh interpreters to measure")
+    parser.add_argument("--max-ms", type=float, help="fail if the median startup time is above this many milliseconds")
+    args = parser.parse_args()
+
+    samples = measure(args.runs)
+    import_ms = statistics.median(sample["import_ms"] for sample in samples)
+    build_ms = statistics.median(sample["build_ms"] for sample in samples)
+    loaded = sorted(set(name for sample in samples for name in sample["loaded"]))
+
+    print("import main:      " + str(round(import_ms, 1)) + " ms (median of " + str(args.runs) + ")")
+    print("build first view: " + str(round(build_ms, 1)) + " ms")
+    print("total:            " + str(round(import_ms + build_ms, 1)) + " ms")
+    print("heavy modules loaded at startup: " + (", ".join(loaded) if loaded else "none"))
+
+    failed = False
+    if loaded:
+        failed = True
+    if args.max_ms is not None and import_ms + build_ms > args.max_ms:
+        print("startup is slower than the " + str(args.max_ms) + " ms budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
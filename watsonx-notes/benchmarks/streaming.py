@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import sample_script
+from generation import TTS_MAX_BYTES, split_sentences, stream_chunks
+from services import stream_text
+
+
+def stand_in(script, token_seconds):
+    # a local stand-in for the watsonx generation_stream endpoint that sends the script
+    # back one word per event at a fixed token rate
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            pieces = script.split(" ")
+            for num, word in enumerate(pieces):
+                piece = word if num == len(pieces) - 1 else word + " "
+                event = {"results": [{"generated_text": piece, "generated_token_count": num + 1}]}
+                self.wfile.write(b"id: " + str(num + 1).encode() + b"\nevent: message\ndata: " + json.dumps(event).encode() + b"\n\n")
+                self.wfile.flush()
+                time.sleep(token_seconds)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how soon streamed script text is ready for synthesis, against a local SSE stand-in.")
+    parser.add_argument("--slides", type=int, default=30, help="slides in the generated script")
+    parser.add_argument("--token-ms", type=float, default=2, help="milliseconds between streamed words")
+    parser.add_argument("--max-bytes", type=int, default=TTS_MAX_BYTES, help="byte budget for each chunk")
+    args = parser.parse_args()
+
+    script = sample_script(args.slides)
+    server = stand_in(script, args.token_ms / 1000)
+    url = "http://127.0.0.1:" + str(server.server_address[1]) + "/"
+
+    started = time.perf_counter()
+    ready = []
+    chunks = []
+    for chunk in stream_chunks(stream_text("Bearer: local", {}, url), args.max_bytes):
+        ready.append(time.perf_counter() - started)
+        chunks.append(chunk)
+    finished = time.perf_counter() - started
+    server.shutdown()
+
+    streamed = [sentence for chunk in chunks for sentence in split_sentences(chunk)]
+    print("script: " + str(len(script.encode("utf-8"))) + " bytes, " + str(args.slides) + " slides")
+    print("  chunks:                " + str(len(chunks)))
+    print("  first chunk ready:     " + str(round(ready[0], 2)) + " s")
+    print("  full script received:  " + str(round(finished, 2)) + " s")
+    print("  sentences preserved:   " + str(streamed == split_sentences(script)))
+    # without streaming, no synthesis request can start before the whole script arrives
+    print("  synthesis head start:  " + str(round(finished - ready[0], 2)) + " s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskCache:
+    # content-addressed files on disk, evicted least recently used first once the
+    # total size goes over max_bytes and dropped once older than ttl seconds, if set;
+    # a file's atime records its last use and its mtime when it was written, so both
+    # survive between runs
+    def __init__(self, directory, max_bytes, ttl=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                if self.expired(stat):
+                    self.remove(name)
+                    continue
+                found.append((stat.st_atime, name, stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def expired(self, stat):
+        return self.ttl is not None and time.time() - stat.st_mtime > self.ttl
+
+    def remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def open(self, key):
+        # returns the entry's open file, or None on a miss
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+            if self.expired(stat):
+                self.remove(key)
+                raise FileNotFoundError(path)
+            f = open(path, "rb")
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+                if key in self.entries:
+                    self.size -= self.entries.pop(key)
+            return None
+
+        with self.lock:
+            self.hits += 1
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        return f
+
+    def get(self, key):
+        f = self.open(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def put(self, key, data):
+        self.store(key, lambda f: f.write(data))
+
+    def put_file(self, key, source):
+        # source is an open binary file, copied into the cache in blocks
+        self.store(key, lambda f: shutil.copyfileobj(source, f))
+
+    def store(self, key, write):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp"
+        with open(temp_path, "wb") as f:
+            write(f)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)
+            self.entries[key] = size
+            self.size += size
+            self.evict()
+
+    def evict(self):
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            self.remove(key)
+
+    def stats(self):
+        return str(self.hits) + " hits, " + str(self.misses) + " misses"
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from cache import cache_key
+
+CHECKPOINT_DIR = "checkpoints"
+READ_BLOCK = 1024 * 1024
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(READ_BLOCK)
+            if not block:
+                return digest.hexdigest()
+            digest.update(block)
+
+
+class Checkpoint:
+    # the completed stages of one job, each written atomically into the job's directory, so
+    # running the same job again after a crash or a failure starts from where it stopped.
+    # key identifies the job: its input and every setting that changes the result
+    def __init__(self, root, kind, key):
+        self.directory = os.path.join(root, kind + "-" + key[:24])
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def open(self, name):
+        try:
+            return open(self.path(name), "rb")
+        except FileNotFoundError:
+            return None
+
+    def store(self, name, write):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = self.path(name) + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp"
+        with open(temp_path, "wb") as f:
+            write(f)
+        os.replace(temp_path, self.path(name))
+
+    def load_text(self, name):
+        f = self.open(name)
+        if f is None:
+            return None
+        with f:
+            return f.read().decode("utf-8")
+
+    def save_text(self, name, text):
+        self.store(name, lambda f: f.write(text.encode("utf-8")))
+
+    def load_json(self, name):
+        text = self.load_text(name)
+        return None if text is None else json.loads(text)
+
+    def save_json(self, name, value):
+        self.save_text(name, json.dumps(value))
+
+    def restore(self, workspace, names):
+        # copies the checkpointed entries among names into the workspace; returns the ones found
+        restored = set()
+        for name in names:
+            f = self.open(name)
+            if f is None:
+                continue
+            with f, workspace.create(name) as output:
+                shutil.copyfileobj(f, output)
+            restored.add(name)
+        return restored
+
+    def keep(self, workspace, name):
+        with workspace.open(name) as source:
+            self.store(name, lambda f: shutil.copyfileobj(source, f))
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def job_checkpoint(settings, kind, path, *parts):
+    # None when checkpoints are turned off by an empty directory setting
+    root = settings.get("checkpoint_dir", CHECKPOINT_DIR)
+    if not root:
+        return None
+    return Checkpoint(root, kind, cache_key(file_digest(path), *parts))
@@ -0,0 +1,1413 @@
+import asyncio
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from async_services import AsyncServices
+from audio import add_chapters, assemble_mp3, extract_segment, mp3_duration, scan_audio, silence_points, split_at_silences
+from cache import DiskCache, cache_key
+from checkpoint import CHECKPOINT_DIR, job_checkpoint
+from jobs import JobCancelled
+from mastering import LOUDNESS_TARGET, SLIDE_GAP, master_mp3
+from metrics import Metrics, describe, span
+from pptx_notes import NotesFormatError, read_notes
+from scheduler import ResponseError, get_scheduler
+from services import GENERATION_PATH, GENERATION_STREAM_PATH, IAM_URL, WATSONX_URL, generate_text, get_speech_to_text, get_text_to_speech, get_token, open_stream, stream_pieces
+from workspace import Workspace, discard_empty, unique_path
+
+DEFAULT_TTS_WORKERS = 4
+DEFAULT_STT_WORKERS = 4
+STT_SEGMENT_LENGTH = 5 * 60 * 1000
+STT_SEGMENT_OVERLAP = 2000
+# recordings are sent to speech to text as mono audio at the 16 kHz of the broadband model;
+# ffmpeg options, file suffix and content type of each upload format
+STT_SAMPLE_RATE = 16000
+STT_UPLOAD_FORMATS = {
+    "opus": (["-ac", "1", "-ar", str(STT_SAMPLE_RATE), "-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg"], ".ogg", "audio/ogg;codecs=opus"),
+    "flac": (["-ac", "1", "-ar", str(STT_SAMPLE_RATE), "-c:a", "flac", "-sample_fmt", "s16", "-f", "flac"], ".flac", "audio/flac"),
+    "mp3": (["-ac", "1", "-ar", str(STT_SAMPLE_RATE), "-c:a", "libmp3lame", "-b:a", "48k", "-f", "mp3"], ".mp3", "audio/mp3")
+}
+STT_UPLOAD_FORMAT = "opus"
+DOWNLOAD_BLOCK = 64 * 1024
+# the TTS service accepts up to 5 KB of text per request, leave some room for the SSML wrapper
+TTS_MAX_BYTES = 4800
+SENTENCE = re.compile(r'\S.*?(?:[.!?]+["\'\u201d\u2019)\]]*(?=\s|$)|(?=\n\s*\n)|$)', re.S)
+PARAGRAPH_BREAK = re.compile(r'\s*?\n\s*\n')
+TTS_CACHE_DIR = os.path.join("cache", "tts")
+TTS_CACHE_MAX_BYTES = 500 * 1024 * 1024
+LLM_CACHE_DIR = os.path.join("cache", "llm")
+LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024
+LLM_CACHE_TTL = 30 * 24 * 60 * 60
+# a script is about as long as its notes, so a batch of notes has to leave room for the
+# 5000 new tokens of the script request; tokens are estimated at four characters each
+DEFAULT_LLM_WORKERS = 4
+SCRIPT_BATCH_TOKENS = 3000
+SCRIPT_CONTEXT_CHARS = 600
+MANIFEST_PREFIX = "narration_manifest"
+SLIDE_AUDIO_DIR = "slide_audio"
+SLIDE_INDEX_NAME = "index.json"
+
+DEFAULT_SETTINGS = {
+    "api_key": "",
+    "stt_api_key": "",
+    "stt_url": "https://api.us-south.speech-to-text.watson.cloud.ibm.com",
+    "notes_prompt": "",
+    "audio_prompt": "",
+    "tts_url": "https://api.us-south.text-to-speech.watson.cloud.ibm.com",
+    "tts_api_key": "",
+    "tts_workers": str(DEFAULT_TTS_WORKERS),
+    "tts_max_bytes": str(TTS_MAX_BYTES),
+    "stt_workers": str(DEFAULT_STT_WORKERS),
+    "stt_format": STT_UPLOAD_FORMAT,
+    "llm_workers": str(DEFAULT_LLM_WORKERS),
+    "script_batch_tokens": str(SCRIPT_BATCH_TOKENS),
+    "llm_cache": True,
+    "checkpoint_dir": CHECKPOINT_DIR,
+    "post_process": True,
+    "loudness_target": str(LOUDNESS_TARGET),
+    "slide_gap": str(SLIDE_GAP),
+    "async_engine": False,
+    "iam_url": IAM_URL,
+    "watsonx_url": WATSONX_URL,
+    "metrics_file": "metrics.jsonl",
+    "prometheus_file": ""
+}
+
+
+class GenerationError(Exception):
+    pass
+
+
+def load_settings(path="settings.json"):
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(path, "r") as f:
+            settings.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except json.decoder.JSONDecodeError:
+        pass
+    return settings
+
+
+def split_sentences(text):
+    # sentences end at terminal punctuation (plus any closing quotes or brackets) or at a
+    # blank line; whitespace inside a sentence is collapsed so no words run together
+    return [" ".join(sentence.split()) for sentence in SENTENCE.findall(text)]
+
+
+def escaped_length(text):
+    return len(clean(text).encode("utf-8"))
+
+
+def split_oversized(text, max_bytes):
+    # fall back to word and then character boundaries for a sentence over the budget
+    pieces = []
+    current = ""
+    for word in text.split(" "):
+        candidate = current + " " + word if current else word
+        if escaped_length(candidate) <= max_bytes:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        current = ""
+        for character in word:
+            if escaped_length(current + character) > max_bytes:
+                pieces.append(current)
+                current = ""
+            current += character
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class ChunkPacker:
+    # packs sentences into as few chunks as possible, each at most max_bytes once escaped
+    # by clean(), so the service gets few requests and no mid-sentence seams
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current = []
+        self.size = 0
+
+    def add(self, sentence):
+        # returns the chunks that the sentence completed
+        length = escaped_length(sentence)
+        if length > self.max_bytes:
+            return self.flush() + split_oversized(sentence, self.max_bytes)
+        chunks = []
+        if self.current and self.size + 1 + length > self.max_bytes:
+            chunks = self.flush()
+        self.size += length + (1 if self.current else 0)
+        self.current.append(sentence)
+        return chunks
+
+    def flush(self):
+        chunks = [" ".join(self.current)] if self.current else []
+        self.current, self.size = [], 0
+        return chunks
+
+
+def get_chunks(text, max_bytes=TTS_MAX_BYTES):
+    packer = ChunkPacker(max_bytes)
+    chunks = []
+    for sentence in split_sentences(text):
+        chunks.extend(packer.add(sentence))
+    return chunks + packer.flush()
+
+
+def stream_chunks(pieces, max_bytes=TTS_MAX_BYTES):
+    # chunk text while it is still being generated: every sentence but the last one seen is
+    # known to be finished, and a chunk is also cut at each paragraph (usually a slide) so
+    # synthesis can start long before the end of the script
+    packer = ChunkPacker(max_bytes)
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        matches = list(SENTENCE.finditer(buffer))
+        for match in matches[:-1]:
+            yield from packer.add(" ".join(match.group().split()))
+            if PARAGRAPH_BREAK.match(buffer, match.end()):
+                yield from packer.flush()
+        if len(matches) > 1:
+            buffer = buffer[matches[-1].start():]
+    for sentence in split_sentences(buffer):
+        yield from packer.add(sentence)
+    yield from packer.flush()
+
+
+def clean(chunk):
+    return chunk.replace('"', '&quot;').replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("'", "&apos;").replace("\n", "")
+
+
+def parse_positive(value, default):
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_number(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def mastering_options(settings):
+    # how the narration is post-processed, or None to join the segments as they are
+    if not settings.get("post_process"):
+        return None
+    return {
+        "loudness": parse_number(settings.get("loudness_target"), LOUDNESS_TARGET),
+        "slide_gap": max(0, int(parse_number(settings.get("slide_gap"), SLIDE_GAP)))
+    }
+
+
+def segment_name(num):
+    return 'segment_' + str(num) + '.mp3'
+
+
+def read_slide_notes(path):
+    try:
+        return read_notes(path)
+    except NotesFormatError as e:
+        raise GenerationError(str(e))
+
+
+def slide_text(slide, notes):
+    return "\n\nSlide " + str(slide + 1) + ": \n" + notes
+
+
+def notes_request(captured_text, project_id):
+    return {
+        "input": """Rewrite the input text in a more formal and concise style, applying the following changes to it:
+            1. Avoid pronouns like I, you, us, we.
+            2. Expand capitalized acronyms.
+            3. Do not change the name of watsonx.data or watsonx.ai.
+            4. Do not include text referring to speaker notes.
+            5. Do not include these instructions in the output.
+            6. Do not explain the revised output or provide a confidence level.
+
+            Input:""" + captured_text + """
+            Output:
+
+            """,
+        "parameters": {
+            "decoding_method": "greedy",
+            "max_new_tokens": 2000,
+            "repetition_penalty": 1
+        },
+        "model_id": "mistralai/mistral-large",
+        "project_id": project_id
+    }
+
+
+def script_request(notes_text, project_id, context=""):
+    # context is the end of the notes before this part of the deck, when the deck is
+    # scripted in batches
+    continuation = ""
+    if context:
+        continuation = """5) This continues a longer presentation, keep the same voice and do not introduce it again. The previous part ended with: """ + context + """
+                """
+    return {
+        "input": """Rewrite the the following text in the following manner:
+                1) Make it conversational
+                2) Tone is professional
+                3) Print the slide number
+                4) Remove all URL from the output
+                """ + continuation + """This is the input:""" + notes_text + """
+                Output:""",
+        "parameters": {
+            "decoding_method": "greedy",
+            "max_new_tokens": 5000,
+            "repetition_penalty": 1
+        },
+        "model_id": "mistralai/mistral-large",
+        "project_id": project_id,
+        "moderations": {
+            "hap": {
+                "input": {
+                    "enabled": True,
+                    "threshold": 0.5,
+                    "mask": {
+                        "remove_entity_value": True
+                    }
+                },
+                "output": {
+                    "enabled": True,
+                    "threshold": 0.5,
+                    "mask": {
+                        "remove_entity_value": True
+                    }
+                }
+            }
+        }
+    }
+
+
+def llm_cache(settings):
+    # greedy decoding makes the output a function of the request, so identical requests
+    # can reuse an earlier result unless fresh output was asked for
+    if not settings.get("llm_cache", True):
+        return None
+    return DiskCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL)
+
+
+def text_key(base_url, body):
+    # both engines and the streaming path share LLM cache entries
+    return cache_key(base_url + GENERATION_PATH, json.dumps(body, sort_keys=True))
+
+
+def cached_text(cache, key, record):
+    # the cached text, or None on a miss
+    data = cache.get(key) if cache is not None else None
+    if data is None:
+        return None
+    record["cached"] = True
+    return data.decode("utf-8")
+
+
+def keep_text(cache, key, text):
+    if cache is not None:
+        cache.put(key, text.encode("utf-8"))
+
+
+def generated_text(auth_token, body, cache=None, base_url=WATSONX_URL, metrics=None):
+    key = text_key(base_url, body)
+    with span(metrics, "llm") as record:
+        text = cached_text(cache, key, record)
+        if text is not None:
+            return text
+
+        def request():
+            response = generate_text(auth_token, body, base_url + GENERATION_PATH)
+            if response.status_code != 200:
+                raise ResponseError(response)
+            record["bytes_received"] += len(response.content)
+            return response.json()["results"][0]["generated_text"]
+
+        record["bytes_sent"] = len(json.dumps(body))
+        try:
+            text = get_scheduler("watsonx").call(request, record=record)
+        except ResponseError as e:
+            raise GenerationError(str(e))
+        keep_text(cache, key, text)
+        return text
+
+
+def streamed_text(auth_token, body, cache=None, base_url=WATSONX_URL, metrics=None):
+    # the streaming counterpart of generated_text; the full response is cached under the
+    # same key once the stream completes
+    key = text_key(base_url, body)
+    with span(metrics, "llm_stream") as record:
+        text = cached_text(cache, key, record)
+        if text is not None:
+            yield text
+            return
+
+        # only opening the stream is retried, text that was already handed on cannot be taken back
+        record["bytes_sent"] = len(json.dumps(body))
+        opened = time.perf_counter()
+        try:
+            response = get_scheduler("watsonx").call(open_stream, auth_token, body, base_url + GENERATION_STREAM_PATH, record=record)
+        except ResponseError as e:
+            raise GenerationError(str(e))
+
+        pieces = []
+        for piece in stream_pieces(response):
+            if not pieces:
+                record["first_piece_seconds"] = round(time.perf_counter() - opened, 3)
+            pieces.append(piece)
+            record["bytes_received"] += len(piece.encode("utf-8"))
+            yield piece
+
+        keep_text(cache, key, "".join(pieces))
+
+
+def generate_script(auth_token, notes_text, project_id, cache=None, base_url=WATSONX_URL, metrics=None):
+    return generated_text(auth_token, script_request(notes_text, project_id), cache, base_url, metrics)
+
+
+def estimated_tokens(text):
+    return len(text) // 4 + 1
+
+
+def script_batches(sections, max_tokens=SCRIPT_BATCH_TOKENS):
+    # group consecutive sections (slides, or sentences of a text file) into batches of at
+    # most max_tokens; a section over the budget gets a batch of its own
+    batches = []
+    current = ""
+    for section in sections:
+        if current and estimated_tokens(current + section) > max_tokens:
+            batches.append(current)
+            current = ""
+        current += section
+    if current:
+        batches.append(current)
+    return batches
+
+
+def batch_context(text, limit=SCRIPT_CONTEXT_CHARS):
+    # the last limit characters of a batch, starting at a word
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    return text[-limit:].split(" ", 1)[-1]
+
+
+def generate_batched_script(auth_token, sections, project_id, workers, on_progress, cache=None, base_url=WATSONX_URL, max_tokens=SCRIPT_BATCH_TOKENS, metrics=None):
+    # script a deck too long for one request: the batches are generated concurrently, each
+    # with the end of the previous batch's notes as context, and joined in order. A deck
+    # that fits in one batch is sent exactly as generate_script sends it
+    bodies = batch_requests(script_batches(sections, max_tokens), project_id)
+    scripts = [""] * len(bodies)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(generated_text, auth_token, body, cache, base_url, metrics): num for num, body in enumerate(bodies)}
+        for completed, future in enumerate(as_completed(futures)):
+            scripts[futures[future]] = future.result()
+            on_progress(completed + 1, len(bodies))
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    return join_scripts(scripts)
+
+
+def batch_requests(batches, project_id):
+    return [script_request(batch, project_id, batch_context(batches[num - 1]) if num else "") for num, batch in enumerate(batches)]
+
+
+def join_scripts(scripts):
+    if len(scripts) == 1:
+        return scripts[0]
+    return "\n\n".join(script.strip() for script in scripts)
+
+
+def synthesize_request(text_to_speech, text, voice, accept, workspace, name):
+    # the response is streamed into the workspace entry in blocks; the entry only replaces
+    # an earlier one once the whole body has arrived
+    response = text_to_speech.synthesize(text, voice=voice, accept=accept, stream=True).get_result()
+    try:
+        with workspace.create(name) as output:
+            for block in response.iter_content(DOWNLOAD_BLOCK):
+                output.write(block)
+    finally:
+        response.close()
+    size = workspace.size(name)
+    if not size:
+        # an empty body is treated like a dropped connection and retried
+        workspace.remove(name)
+        raise OSError("Empty audio response")
+    return size
+
+
+def synthesize_chunk(text_to_speech, text, voice, accept, workspace, name, cache=None, metrics=None):
+    # writes the audio for text to the workspace entry name, copied from the cache when it is there
+    with span(metrics, "tts") as record:
+        record["bytes_sent"] = len(text.encode("utf-8"))
+        key = speech_key(text, voice, text_to_speech.service_url, accept)
+        if copy_cached(cache, key, workspace, name, record):
+            return
+        record["bytes_received"] = get_scheduler("tts").call(synthesize_request, text_to_speech, text, voice, accept, workspace, name, record=record)
+        keep_cached(cache, key, workspace, name)
+
+
+def speech_key(text, voice, service_url, accept):
+    # the SDK drops a trailing slash from the service URL, so it is dropped here too and
+    # both engines share TTS cache entries
+    return cache_key(text, voice, service_url.rstrip("/"), accept)
+
+
+def copy_cached(cache, key, workspace, name, record):
+    # copies a cached entry into the workspace; returns False on a miss
+    cached = cache.open(key) if cache is not None else None
+    if cached is None:
+        return False
+    with cached, workspace.create(name) as output:
+        shutil.copyfileobj(cached, output)
+    record["cached"] = True
+    return True
+
+
+def keep_cached(cache, key, workspace, name):
+    if cache is not None:
+        with workspace.open(name) as source:
+            cache.put_file(key, source)
+
+
+def synthesize_segment(text_to_speech, num, chunk, voice, workspace, cache=None, metrics=None):
+    synthesize_chunk(text_to_speech, clean(chunk), voice, 'audio/mp3', workspace, segment_name(num), cache, metrics)
+
+
+class SegmentProgress:
+    # the bookkeeping both engines share while they work through numbered segments: the
+    # results restored from an earlier run, the ones still pending, the failures, and
+    # progress weighted by the size of every segment. keep(num, result) is called with
+    # each new result, to put it in the checkpoint
+    def __init__(self, sizes, restored, on_progress, keep):
+        self.sizes = sizes
+        self.results = dict(restored)
+        self.pending = [num for num in range(len(sizes)) if num not in restored]
+        self.on_progress = on_progress
+        self.keep = keep
+        self.failures = {}
+        self.completed = len(restored)
+        self.done = sum(sizes[num] for num in restored)
+
+    def finish(self, num, future):
+        # takes a finished concurrent future or asyncio task
+        if future.exception() is not None:
+            self.failures[num] = str(future.exception())
+        else:
+            self.results[num] = future.result()
+            self.keep(num, self.results[num])
+        self.completed += 1
+        self.done += self.sizes[num]
+        self.on_progress(self.completed, len(self.sizes), self.done / max(sum(self.sizes), 1))
+
+
+def segment_progress(chunks, on_progress, workspace, checkpoint=None):
+    # the SegmentProgress of a synthesis; with a checkpoint, the segments an earlier run
+    # finished are copied back into the workspace and every new one is kept
+    restored = {}
+    if checkpoint is not None:
+        names = [segment_name(num) for num in range(len(chunks))]
+        found = checkpoint.restore(workspace, names)
+        restored = {num: None for num in range(len(chunks)) if names[num] in found}
+
+    def keep(num, result):
+        if checkpoint is not None:
+            checkpoint.keep(workspace, segment_name(num))
+
+    return SegmentProgress([escaped_length(chunk) for chunk in chunks], restored, on_progress, keep)
+
+
+def synthesize_chunks(text_to_speech, chunks, voice, workers, on_progress, workspace, cache=None, metrics=None, checkpoint=None):
+    # synthesize the chunks on a bounded pool; each result is written to its own numbered
+    # workspace entry so the chunk order is kept no matter which request finishes first. on_progress
+    # also gets the share of the text synthesized so far. With a checkpoint, segments an
+    # earlier run finished are reused and every new one is kept
+    progress = segment_progress(chunks, on_progress, workspace, checkpoint)
+
+    # shutting down with cancel_futures drops the queued requests when on_progress raises,
+    # for example because the job was cancelled
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(synthesize_segment, text_to_speech, num, chunks[num], voice, workspace, cache, metrics): num for num in progress.pending}
+        for future in as_completed(futures):
+            progress.finish(futures[future], future)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    return progress.failures
+
+
+def synthesize_stream(text_to_speech, chunks, voice, workers, on_progress, workspace, cache=None, metrics=None):
+    # like synthesize_chunks, but chunks is an iterator that yields while the script is still
+    # being generated; each chunk goes to the pool as soon as it arrives. Returns the number
+    # of chunks and the ones that failed
+    failures = {}
+    futures = {}
+    sizes = []
+    done = 0
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for num, chunk in enumerate(chunks):
+            futures[executor.submit(synthesize_segment, text_to_speech, num, chunk, voice, workspace, cache, metrics)] = num
+            sizes.append(escaped_length(chunk))
+            on_progress(sum(1 for future in futures if future.done()), len(futures), None)
+        for completed, future in enumerate(as_completed(futures)):
+            try:
+                future.result()
+            except Exception as e:
+                failures[futures[future]] = str(e)
+            done += sizes[futures[future]]
+            on_progress(completed + 1, len(futures), done / max(sum(sizes), 1))
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    return len(futures), failures
+
+
+def stt_format(settings):
+    value = str(settings.get("stt_format", "")).lower()
+    return value if value in STT_UPLOAD_FORMATS else STT_UPLOAD_FORMAT
+
+
+def export_segment(path, segment, upload_format, metrics=None):
+    # cut the segment out of the recording as compact mono audio, so a screen recording is
+    # sent as a small audio file rather than video; returns the temporary file and its
+    # content type
+    start, end = segment[:2]
+    options, suffix, content_type = STT_UPLOAD_FORMATS[upload_format]
+    handle, upload_path = tempfile.mkstemp(suffix=suffix)
+    os.close(handle)
+    try:
+        with span(metrics, "stt_export", audio_ms=end - start) as record:
+            extract_segment(path, start, end, upload_path, options)
+            record["bytes_received"] = os.path.getsize(upload_path)
+    except BaseException:
+        os.remove(upload_path)
+        raise
+    return upload_path, content_type
+
+
+def recognize_segment(speech_to_text, path, segment, upload_format=STT_UPLOAD_FORMAT, metrics=None):
+    # the upload is streamed from the exported file
+    upload_path, content_type = export_segment(path, segment, upload_format, metrics)
+    try:
+        with span(metrics, "stt") as record:
+            record["bytes_sent"] = os.path.getsize(upload_path)
+            with open(upload_path, "rb") as audio_file:
+                def request():
+                    audio_file.seek(0)
+                    return speech_to_text.recognize(audio_file, content_type=content_type, model='en-US_BroadbandModel', timestamps=True).get_result()
+
+                response = get_scheduler("stt").call(request, record=record)
+            record["bytes_received"] = len(json.dumps(response))
+    finally:
+        os.remove(upload_path)
+
+    return segment_words(response, segment)
+
+
+def segment_words(response, segment):
+    # segments overlap, so only keep the words centred inside this segment's own range
+    start, end, core_start, core_end = segment
+    words = []
+    for result in response['results']:
+        alternative = result['alternatives'][0]
+        if not alternative.get('timestamps'):
+            words.append(alternative['transcript'].strip())
+            continue
+        for word, word_start, word_end in alternative['timestamps']:
+            midpoint = start + (word_start + word_end) * 500
+            if core_start <= midpoint < core_end:
+                words.append(word)
+    return " ".join(words)
+
+
+def plan_segments(path, metrics=None):
+    # returns the recording's duration and its segments
+    with span(metrics, "scan") as record:
+        record["bytes_sent"] = os.path.getsize(path)
+        duration, levels = scan_audio(path)
+    if not duration:
+        raise Exception("No audio found in " + os.path.basename(path))
+
+    silences = silence_points(levels) if duration > STT_SEGMENT_LENGTH else []
+    return duration, split_at_silences(duration, silences, STT_SEGMENT_LENGTH, STT_SEGMENT_OVERLAP)
+
+
+def checkpointed_segments(path, checkpoint, metrics=None):
+    # plan_segments, skipped when an earlier run of the job already scanned the recording
+    planned = checkpoint.load_json("segments.json") if checkpoint is not None else None
+    if planned is not None:
+        return planned["duration"], [tuple(segment) for segment in planned["segments"]]
+    duration, segments = plan_segments(path, metrics)
+    if checkpoint is not None:
+        checkpoint.save_json("segments.json", {"duration": duration, "segments": segments})
+    return duration, segments
+
+
+def transcript_progress(segments, on_progress, checkpoint=None):
+    # the SegmentProgress of a transcription, weighted by the length of every segment's own
+    # range; with a checkpoint, the transcripts an earlier run finished are reused and every
+    # new one is kept
+    restored = {}
+    if checkpoint is not None:
+        texts = {num: checkpoint.load_text("transcript_" + str(num) + ".txt") for num in range(len(segments))}
+        restored = {num: text for num, text in texts.items() if text is not None}
+
+    def keep(num, text):
+        if checkpoint is not None:
+            checkpoint.save_text("transcript_" + str(num) + ".txt", text)
+
+    return SegmentProgress([core_end - core_start for start, end, core_start, core_end in segments], restored, on_progress, keep)
+
+
+def stitched_transcript(progress):
+    # the transcripts in order and the segments that failed
+    transcripts = [progress.results.get(num, "") for num in range(len(progress.sizes))]
+    return " ".join(transcript for transcript in transcripts if transcript), progress.failures
+
+
+def check_recognized(captured_text, failures):
+    # a recording nothing could be recognized in fails with the first failed segment's error
+    if not captured_text and failures:
+        raise GenerationError('Failed: ' + failures[min(failures)])
+
+
+def transcribe(speech_to_text, path, workers, on_progress, metrics=None, upload_format=STT_UPLOAD_FORMAT, checkpoint=None):
+    # split long recordings at silences and recognize the segments concurrently; returns the
+    # stitched transcript and the segments that failed. on_progress also gets the share of
+    # the recording recognized so far. With a checkpoint, the scan and the segments an
+    # earlier run finished are reused and every new transcript is kept
+    _, segments = checkpointed_segments(path, checkpoint, metrics)
+    progress = transcript_progress(segments, on_progress, checkpoint)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(recognize_segment, speech_to_text, path, segments[num], upload_format, metrics): num for num in progress.pending}
+        for future in as_completed(futures):
+            progress.finish(futures[future], future)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    return stitched_transcript(progress)
+
+
+def engine_limits(settings):
+    # with the async engine the worker settings are the most requests in flight per service
+    return {
+        "watsonx": parse_positive(settings.get("llm_workers"), DEFAULT_LLM_WORKERS),
+        "tts": parse_positive(settings.get("tts_workers"), DEFAULT_TTS_WORKERS),
+        "stt": parse_positive(settings.get("stt_workers"), DEFAULT_STT_WORKERS)
+    }
+
+
+def limit_schedulers(settings):
+    # the threaded schedulers start at and never go over the worker count of their pools,
+    # so halving the limit actually lowers the requests in flight
+    for name, limit in engine_limits(settings).items():
+        get_scheduler(name, limit)
+
+
+async def run_tasks(coroutines, on_done):
+    # run the coroutines concurrently and call on_done(num, task, completed) as each one
+    # finishes; when on_done raises, for example because the job was cancelled, the
+    # remaining ones are cancelled along with their requests
+    tasks = {asyncio.ensure_future(coroutine): num for num, coroutine in enumerate(coroutines)}
+    pending = set(tasks)
+    completed = 0
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                completed += 1
+                on_done(tasks[task], task, completed)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def generated_text_async(services, body, cache=None, metrics=None):
+    key = text_key(services.settings["watsonx_url"], body)
+    with span(metrics, "llm") as record:
+        text = cached_text(cache, key, record)
+        if text is not None:
+            return text
+
+        record["bytes_sent"] = len(json.dumps(body))
+        try:
+            text = await services.generate(body, record)
+        except ResponseError as e:
+            raise GenerationError(str(e))
+        keep_text(cache, key, text)
+        return text
+
+
+async def generate_batched_script_async(services, sections, project_id, on_progress, cache=None, max_tokens=SCRIPT_BATCH_TOKENS, metrics=None):
+    bodies = batch_requests(script_batches(sections, max_tokens), project_id)
+    scripts = [""] * len(bodies)
+
+    def finished(num, task, completed):
+        scripts[num] = task.result()
+        on_progress(completed, len(bodies))
+
+    await run_tasks([generated_text_async(services, body, cache, metrics) for body in bodies], finished)
+    return join_scripts(scripts)
+
+
+async def synthesize_segment_async(services, num, chunk, voice, workspace, cache=None, metrics=None):
+    text = clean(chunk)
+    accept = 'audio/mp3'
+    with span(metrics, "tts") as record:
+        record["bytes_sent"] = len(text.encode("utf-8"))
+        key = speech_key(text, voice, services.settings["tts_url"], accept)
+        if copy_cached(cache, key, workspace, segment_name(num), record):
+            return
+        record["bytes_received"] = await services.synthesize(text, voice, accept, workspace, segment_name(num), record)
+        keep_cached(cache, key, workspace, segment_name(num))
+
+
+async def synthesize_chunks_async(services, chunks, voice, on_progress, workspace, cache=None, metrics=None, checkpoint=None):
+    # synthesize_chunks on the async engine, with every chunk in flight at once as far as
+    # the TTS scheduler allows
+    progress = segment_progress(chunks, on_progress, workspace, checkpoint)
+    await run_tasks([synthesize_segment_async(services, num, chunks[num], voice, workspace, cache, metrics) for num in progress.pending],
+                    lambda index, task, completed: progress.finish(progress.pending[index], task))
+    return progress.failures
+
+
+async def recognize_segment_async(services, path, segment, upload_format=STT_UPLOAD_FORMAT, metrics=None):
+    # recognize_segment on the async engine; ffmpeg runs on a worker thread
+    upload_path, content_type = await asyncio.to_thread(export_segment, path, segment, upload_format, metrics)
+    try:
+        with span(metrics, "stt") as record:
+            record["bytes_sent"] = os.path.getsize(upload_path)
+            with open(upload_path, "rb") as audio_file:
+                response = await services.recognize(audio_file, content_type, record)
+            record["bytes_received"] = len(json.dumps(response))
+    finally:
+        os.remove(upload_path)
+
+    return segment_words(response, segment)
+
+
+async def transcribe_async(services, path, on_progress, metrics=None, upload_format=STT_UPLOAD_FORMAT, checkpoint=None):
+    _, segments = await asyncio.to_thread(checkpointed_segments, path, checkpoint, metrics)
+    progress = transcript_progress(segments, on_progress, checkpoint)
+    await run_tasks([recognize_segment_async(services, path, segments[num], upload_format, metrics) for num in progress.pending],
+                    lambda index, task, completed: progress.finish(progress.pending[index], task))
+    return stitched_transcript(progress)
+
+
+class SlidePipeline:
+    # three overlapping stages: a producer thread scripts the slides in order, every finished
+    # script is chunked straight onto the TTS pool, and the calling thread joins each slide's
+    # segments into its own file in directory as soon as they are ready; slides whose key
+    # matches a complete entry of the previous manifest are reused without scripting or synthesis,
+    # unless reuse is off because fresh output was asked for
+    def __init__(self, script_slide, text_to_speech, voice, workers, workspace, cache=None, directory=".", max_bytes=TTS_MAX_BYTES, previous=None, metrics=None,
+                 mastering=None, slide_dir=None, manifest_path=None, reuse=True):
+        self.script_slide = script_slide
+        self.text_to_speech = text_to_speech
+        self.voice = voice
+        self.workers = workers
+        self.workspace = workspace
+        self.cache = cache
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.previous = previous or {}
+        self.metrics = metrics
+        self.mastering = mastering
+        self.slide_dir = slide_dir
+        self.manifest_path = manifest_path
+        self.reuse = reuse
+        self.scripts = []
+        self.spans = []
+        self.slide_files = []
+        self.entries = {}
+        self.finished = []
+        self.script_failures = {}
+        self.failures = {}
+        self.scripted = 0
+        self.reused = 0
+        self.queued = 0
+        self.written = 0
+        self.stopped = threading.Event()
+
+    def reusable(self, key):
+        entry = self.previous.get(key) if self.reuse else None
+        if entry is None or not entry["complete"]:
+            return None
+        if entry["audio"] and not os.path.exists(os.path.join(self.directory, entry["audio"])):
+            return None
+        return entry
+
+    def produce(self, slides, keys, executor, pending):
+        try:
+            for slide, notes in enumerate(slides):
+                if self.stopped.is_set():
+                    break
+                previous = self.reusable(keys[slide])
+                if previous is not None:
+                    self.scripts[slide] = previous["script"]
+                    self.entries[slide] = dict(previous, slide=slide)
+                    self.reused += 1
+                else:
+                    entry = {"slide": slide, "key": keys[slide], "script": "", "audio": None, "duration": 0, "complete": True}
+                    self.entries[slide] = entry
+                    if notes.strip():
+                        try:
+                            entry["script"] = self.script_slide(slide, notes)
+                        except Exception as e:
+                            self.script_failures[slide] = str(e)
+                            entry["complete"] = False
+                        self.scripts[slide] = entry["script"]
+                        for chunk in get_chunks(entry["script"], self.max_bytes):
+                            if chunk:
+                                try:
+                                    future = executor.submit(synthesize_segment, self.text_to_speech, self.queued, chunk, self.voice, self.workspace, self.cache, self.metrics)
+                                except RuntimeError:
+                                    # the consumer stopped and shut the pool down
+                                    return
+                                pending.put((slide, self.queued, future))
+                                self.queued += 1
+                # marks the end of the slide's segments
+                pending.put((slide, None, None))
+                self.scripted += 1
+        finally:
+            pending.put(None)
+
+    def finish_slide(self, slide, segments):
+        entry = self.entries[slide]
+        if not segments:
+            return
+        entry["audio"] = os.path.join(SLIDE_AUDIO_DIR, entry["key"] + ".mp3")
+        path = os.path.join(self.directory, entry["audio"])
+        # another job narrating the same deck may write the same slide, so replace it in one step
+        temp_path = path + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp"
+        try:
+            with span(self.metrics, "combine_slide", slide=slide) as record:
+                failures = assemble_mp3(segments, temp_path, lead_in=0, opener=self.workspace.open)
+                record["bytes_received"] = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            for num, name in segments:
+                self.workspace.remove(name)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if failures:
+            self.failures.update(failures)
+            entry["complete"] = False
+        entry["duration"] = mp3_duration(path)
+
+    def run(self, slides, keys, output_path, on_progress):
+        self.scripts = [""] * len(slides)
+        pending = queue.Queue()
+        segments = []
+        os.makedirs(os.path.join(self.directory, SLIDE_AUDIO_DIR), exist_ok=True)
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        producer = threading.Thread(target=self.produce, args=(slides, keys, executor, pending), daemon=True)
+        producer.start()
+
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+                slide, num, future = item
+                if future is None:
+                    self.finish_slide(slide, segments)
+                    segments = []
+                    self.finished.append(slide)
+                    self.checkpoint()
+                    on_progress(self)
+                    continue
+                try:
+                    future.result()
+                except Exception as e:
+                    self.failures[num] = str(e)
+                    self.entries[slide]["complete"] = False
+                else:
+                    segments.append((num, segment_name(num)))
+                self.written += 1
+                on_progress(self)
+        finally:
+            self.stopped.set()
+            executor.shutdown(cancel_futures=True)
+            for num in range(self.queued):
+                self.workspace.remove(segment_name(num))
+
+        # splice the new and reused slide audio together frame by frame, or master it with a
+        # gap between the slides; either way every slide's span in the output is kept, and with
+        # a slide_dir each slide is also written to its own file there
+        groups = [[(slide, os.path.join(self.directory, entry["audio"]))] if entry["audio"] else [] for slide, entry in sorted(self.entries.items())]
+        slide_paths = [None] * len(groups)
+        if self.slide_dir is not None:
+            width = len(str(len(groups)))
+            slide_paths = [os.path.join(self.slide_dir, "slide_" + str(slide + 1).zfill(width) + ".mp3") if group else None for slide, group in enumerate(groups)]
+        with span(self.metrics, "combine") as record:
+            if self.mastering is None:
+                failures = assemble_mp3([item for group in groups for item in group], output_path)
+                self.spans = joined_spans([self.entries[slide]["duration"] if group else 0 for slide, group in enumerate(groups)])
+                for group, path in zip(groups, slide_paths):
+                    if path is not None:
+                        shutil.copyfile(group[0][1], path)
+                written = slide_paths
+            else:
+                failures, self.spans, written = master_mp3(groups, output_path, self.workspace, group_paths=slide_paths, **self.mastering)
+            record["bytes_received"] = os.path.getsize(output_path)
+        # only the files that were written, a slide whose audio failed or was all trimmed has none
+        self.slide_files = [None if slide in failures else path for slide, path in enumerate(written)]
+        if failures:
+            raise GenerationError("Could not combine the audio of slide(s) " + ", ".join(str(slide + 1) for slide in sorted(failures)))
+
+        return self.failures
+
+    def checkpoint(self):
+        # the slides finished so far next to the previous entries of the ones still to come, so
+        # a run that crashes or is cancelled resumes from the last finished slide
+        if self.manifest_path is None:
+            return
+        entries = dict(self.previous)
+        entries.update((self.entries[slide]["key"], self.entries[slide]) for slide in self.finished)
+        write_manifest(self.manifest_path, {"slides": list(entries.values())})
+
+    def manifest(self):
+        return {"slides": [self.entries[slide] for slide in sorted(self.entries)]}
+
+
+def joined_spans(durations, lead_in=100):
+    # (start, end) in ms of audio joined one after the other behind the lead-in
+    spans = []
+    position = lead_in
+    for duration in durations:
+        spans.append((position, position + duration))
+        position += duration
+    return spans
+
+
+def save_slide_index(path, output_path, slide_files, spans):
+    # the slide start times for players that seek by slide, with the file of every slide
+    slides = [{
+        "slide": slide + 1,
+        "title": "Slide " + str(slide + 1),
+        "start": start / 1000,
+        "end": end / 1000,
+        "file": os.path.basename(slide_file) if slide_file else None
+    } for slide, (slide_file, (start, end)) in enumerate(zip(slide_files, spans))]
+    with open(path, "w") as f:
+        json.dump({"output": os.path.relpath(output_path, os.path.dirname(path)), "slides": slides}, f, indent=2)
+
+
+def slide_key(slide, notes, voice, settings, max_bytes):
+    # everything that changes a slide's narration: the scripting input and prompt, and the
+    # voice, service and chunking used to synthesize it
+    return cache_key(slide_text(slide, notes), settings["notes_prompt"], voice, settings["tts_url"], max_bytes)
+
+
+def load_manifest(path):
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+    return {entry["key"]: entry for entry in manifest.get("slides", [])}
+
+
+def deck_manifest_path(directory, deck_path):
+    # one manifest per deck, so narrating another deck into the same folder keeps this one's slides
+    stem = os.path.splitext(os.path.basename(deck_path))[0]
+    return os.path.join(directory, MANIFEST_PREFIX + "-" + stem + "-" + cache_key(os.path.abspath(deck_path))[:8] + ".json")
+
+
+def write_manifest(path, manifest):
+    # jobs run as threads of one process, so the thread is part of the temporary name
+    temp_path = path + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def save_manifest(path, manifest, directory, previous):
+    write_manifest(path, manifest)
+
+    # drop the audio of slides that are no longer part of this deck, unless the manifest of
+    # another deck in the same folder still uses it
+    used = set(entry["audio"] for entry in manifest["slides"] if entry["audio"])
+    for name in os.listdir(directory):
+        other_path = os.path.join(directory, name)
+        if name.startswith(MANIFEST_PREFIX) and name.endswith(".json") and other_path != path:
+            used.update(entry["audio"] for entry in load_manifest(other_path).values() if entry["audio"])
+    for entry in previous.values():
+        if entry["audio"] and entry["audio"] not in used:
+            try:
+                os.remove(os.path.join(directory, entry["audio"]))
+            except FileNotFoundError:
+                pass
+
+
+def job_metrics(settings, job):
+    return Metrics(job, settings.get("metrics_file") or None, settings.get("prometheus_file") or None)
+
+
+def fetch_token(settings, metrics=None):
+    with span(metrics, "token"):
+        return get_token(settings["api_key"], settings["iam_url"])
+
+
+def combine_segments(workspace, nums, output_path, metrics=None, mastering=None):
+    # assemble the numbered segments in order, post-processed unless mastering is None, and
+    # drop them from the workspace
+    segments = [(num, segment_name(num)) for num in nums]
+    try:
+        with span(metrics, "combine") as record:
+            if mastering is None:
+                failures = assemble_mp3(segments, output_path, opener=workspace.open)
+            else:
+                failures = master_mp3([segments], output_path, workspace, workspace.open, **mastering)[0]
+            record["bytes_received"] = os.path.getsize(output_path)
+    finally:
+        for num, name in segments:
+            workspace.remove(name)
+    return failures
+
+
+def generate_notes(settings, audio_path, output_path, on_status, metrics=None):
+    # transcribe a recording and rewrite it as speaker notes; returns the audio segments
+    # that could not be recognized
+    if metrics is None:
+        metrics = job_metrics(settings, "notes")
+    try:
+        return run_notes(settings, audio_path, output_path, on_status, metrics)
+    except BaseException:
+        discard_empty([output_path])
+        raise
+    finally:
+        metrics.write_prometheus()
+
+
+def run_notes(settings, audio_path, output_path, on_status, metrics):
+    limit_schedulers(settings)
+
+    def recognition_progress(completed, total, fraction):
+        on_status("Recognized audio segment " + str(completed) + "/" + str(total), fraction * .85 + 0.05)
+
+    # the silence scan, every recognized segment and the notes are kept until the job
+    # finishes, so running it again after a crash or failed segments resumes where it stopped
+    # finished notes are only reused when the LLM cache is on, fresh output regenerates them
+    # from the checkpointed transcripts
+    checkpoint = job_checkpoint(settings, "notes", audio_path, settings["audio_prompt"], settings["stt_url"], settings["watsonx_url"], stt_format(settings), STT_SEGMENT_LENGTH)
+    data = checkpoint.load_text("notes.txt") if checkpoint is not None and settings.get("llm_cache", True) else None
+    if data is not None:
+        failures = {}
+    elif settings.get("async_engine"):
+        data, failures = asyncio.run(notes_async(settings, audio_path, on_status, recognition_progress, metrics, checkpoint))
+    else:
+        speech_to_text = get_speech_to_text(settings["stt_api_key"], settings["stt_url"], settings["iam_url"])
+
+        on_status('Recognizing audio file, this may take a few minutes...', .05)
+
+        workers = parse_positive(settings.get("stt_workers"), DEFAULT_STT_WORKERS)
+        try:
+            captured_text, failures = transcribe(speech_to_text, audio_path, workers, recognition_progress, metrics, stt_format(settings), checkpoint)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            raise GenerationError('Failed: ' + str(e))
+
+        check_recognized(captured_text, failures)
+
+        # the service gives no progress for a generation, so the ring spins until it returns
+        on_status('Generating speaker notes text...', None)
+
+        # fetched only now, a long transcription could outlast a token fetched at the start
+        auth_token = fetch_token(settings, metrics)
+        data = generated_text(auth_token, notes_request(captured_text, settings["audio_prompt"]), llm_cache(settings), settings["watsonx_url"], metrics)
+
+    # notes from an incomplete transcript are not kept, a rerun retries the failed segments
+    if checkpoint is not None and not failures:
+        checkpoint.save_text("notes.txt", data)
+
+    on_status('Writing output...', .95)
+
+    with span(metrics, "write") as record:
+        with open(output_path, "w") as text_file:
+            text_file.write(data)
+        record["bytes_received"] = len(data.encode("utf-8"))
+
+    if checkpoint is not None and not failures:
+        checkpoint.clear()
+
+    return failures
+
+
+async def notes_async(settings, audio_path, on_status, recognition_progress, metrics, checkpoint=None):
+    # the network steps of run_notes on the async engine; returns the notes and the audio
+    # segments that failed
+    async with AsyncServices(settings, engine_limits(settings)) as services:
+        on_status('Recognizing audio file, this may take a few minutes...', .05)
+        try:
+            captured_text, failures = await transcribe_async(services, audio_path, recognition_progress, metrics, stt_format(settings), checkpoint)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            raise GenerationError('Failed: ' + str(e))
+
+        check_recognized(captured_text, failures)
+
+        on_status('Generating speaker notes text...', None)
+        data = await generated_text_async(services, notes_request(captured_text, settings["audio_prompt"]), llm_cache(settings), metrics)
+    return data, failures
+
+
+def generate_audio(settings, notes_path, voice, output_dir, on_status, pipeline=False, stream=False, metrics=None, slide_files=False):
+    # script a pptx/txt file and narrate it into output_dir; returns the slide scripts and
+    # audio segments that failed along with the cache statistics, the time spent per stage
+    # and the output files, which are named so that concurrent jobs never share one. With
+    # slide_files a PowerPoint file is narrated slide by slide, and the output gets chapter
+    # markers and a folder with the audio of every slide and an index of the slide times
+    if metrics is None:
+        metrics = job_metrics(settings, "audio")
+    script_path = unique_path(output_dir, "script_output.txt")
+    output_path = unique_path(output_dir, "final_output.mp3")
+    slide_dir = os.path.splitext(output_path)[0] + "_slides" if slide_files else None
+    try:
+        with Workspace() as workspace:
+            result = run_audio(settings, notes_path, voice, output_dir, script_path, output_path, workspace, on_status, pipeline, stream, metrics, slide_dir)
+    except BaseException:
+        discard_empty([script_path, output_path])
+        if slide_dir is not None and os.path.isdir(slide_dir) and not os.listdir(slide_dir):
+            os.rmdir(slide_dir)
+        raise
+    finally:
+        metrics.write_prometheus()
+    result["stages"] = metrics.summary()
+    result["script"] = script_path
+    result["output"] = output_path
+    return result
+
+
+def run_audio(settings, notes_path, voice, output_dir, script_path, output_path, workspace, on_status, pipeline, stream, metrics, slide_dir=None):
+    limit_schedulers(settings)
+    script_failures = {}
+    slides = None
+    notes_text = ""
+
+    # determine if the file is ppt; if so, pull the notes
+    if ".ppt" in os.path.basename(notes_path):
+        on_status("Reading powerpoint slides...", None)
+        with span(metrics, "pptx_read") as record:
+            record["bytes_sent"] = os.path.getsize(notes_path)
+            slides = read_slide_notes(notes_path)
+        notes_text = "".join(slide_text(slide, notes) for slide, notes in enumerate(slides))
+    else:
+        with open(notes_path, "rb") as fp:
+            on_status("Reading text file...", None)
+            notes_text = str(fp.read())
+
+    # slide files need the slide boundaries, which only the slide by slide narration has
+    if slides is None:
+        slide_dir = None
+    elif slide_dir is not None:
+        pipeline = True
+
+    # the async engine runs the whole-deck path; the slide pipeline and streaming stay on threads
+    use_engine = settings.get("async_engine") and not (slides is not None and pipeline) and not stream
+    text_to_speech = None
+    if not use_engine:
+        on_status("Authenticating with TTS service...", None)
+        text_to_speech = get_text_to_speech(settings["tts_api_key"], settings["tts_url"], settings["iam_url"])
+    tts_cache = DiskCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+    text_cache = llm_cache(settings)
+    workers = parse_positive(settings.get("tts_workers"), DEFAULT_TTS_WORKERS)
+    max_bytes = parse_positive(settings.get("tts_max_bytes"), TTS_MAX_BYTES)
+
+    if slides is not None and pipeline:
+        def script_slide(slide, notes):
+            return generate_script(fetch_token(settings, metrics), slide_text(slide, notes), settings["notes_prompt"], text_cache, settings["watsonx_url"], metrics)
+
+        # progress is the share of the notes scripted plus the share of the queued audio written
+        def pipeline_progress(slide_pipeline):
+            status_text = "Scripted slide " + str(slide_pipeline.scripted) + "/" + str(len(slides)) + " (" + str(slide_pipeline.reused) + " unchanged), generated audio segment " + str(slide_pipeline.written) + "/" + str(slide_pipeline.queued) + " (cache: " + tts_cache.stats() + ")"
+            on_status(status_text, slide_pipeline.scripted / len(slides) * .45 + slide_pipeline.written / max(slide_pipeline.queued, 1) * .45 + 0.05)
+
+        on_status("Getting slide scripts from watsonx prompt...", .05)
+        manifest_path = deck_manifest_path(output_dir, notes_path)
+        previous = load_manifest(manifest_path)
+        keys = [slide_key(slide, notes, voice, settings, max_bytes) for slide, notes in enumerate(slides)]
+        slide_pipeline = SlidePipeline(script_slide, text_to_speech, voice, workers, workspace, tts_cache, output_dir, max_bytes, previous, metrics,
+                                       mastering_options(settings), slide_dir, manifest_path, text_cache is not None)
+        if slide_dir is not None:
+            os.makedirs(slide_dir, exist_ok=True)
+        audio_failures = slide_pipeline.run(slides, keys, output_path, pipeline_progress)
+        script_failures = slide_pipeline.script_failures
+        save_manifest(manifest_path, slide_pipeline.manifest(), output_dir, previous)
+
+        if slide_dir is not None:
+            with span(metrics, "chapters"):
+                # slides without narration stay in the index but get no chapter
+                add_chapters(output_path, [("Slide " + str(slide + 1), start, end) for slide, (start, end) in enumerate(slide_pipeline.spans) if end > start])
+                save_slide_index(os.path.join(slide_dir, SLIDE_INDEX_NAME), output_path, slide_pipeline.slide_files, slide_pipeline.spans)
+
+        with open(script_path, "w") as fp:
+            fp.write("\n\n".join(script for script in slide_pipeline.scripts if script))
+    elif stream:
+        on_status("Streaming script from watsonx prompt...", None)
+        auth_token = fetch_token(settings, metrics)
+        script_pieces = []
+
+        def script_stream():
+            for piece in streamed_text(auth_token, script_request(notes_text, settings["notes_prompt"]), text_cache, settings["watsonx_url"], metrics):
+                script_pieces.append(piece)
+                yield piece
+
+        def stream_progress(completed, total, fraction):
+            if fraction is None:
+                status_text = "Streaming script, generated audio segment " + str(completed) + "/" + str(total) + " so far (cache: " + tts_cache.stats() + ")"
+                on_status(status_text, None)
+            else:
+                status_text = "Generated audio segment " + str(completed) + "/" + str(total) + " (cache: " + tts_cache.stats() + ")"
+                on_status(status_text, fraction * .85 + 0.05)
+
+        try:
+            count, audio_failures = synthesize_stream(text_to_speech, stream_chunks(script_stream(), max_bytes), voice, workers, stream_progress, workspace, tts_cache, metrics)
+        except Exception as e:
+            # a cancelled job is not a failed script
+            if script_pieces or isinstance(e, JobCancelled):
+                raise
+            raise GenerationError("Script generation failed: " + str(e))
+
+        with open(script_path, "w") as fp:
+            fp.write("".join(script_pieces))
+
+        on_status("Combining audio files...", .90)
+
+        nums = [num for num in range(count) if num not in audio_failures]
+        audio_failures.update(combine_segments(workspace, nums, output_path, metrics, mastering_options(settings)))
+    else:
+        # the service gives no progress for a generation, so the ring spins until it returns
+        on_status("Getting script from watsonx prompt...", None)
+        max_tokens = parse_positive(settings.get("script_batch_tokens"), SCRIPT_BATCH_TOKENS)
+        if slides is not None:
+            sections = [slide_text(slide, notes) for slide, notes in enumerate(slides)]
+        elif estimated_tokens(notes_text) > max_tokens:
+            sections = [sentence + " " for sentence in split_sentences(notes_text)]
+        else:
+            sections = [notes_text]
+
+        def script_progress(completed, total):
+            on_status("Generated script part " + str(completed) + "/" + str(total), None)
+
+        def synthesis_progress(completed, total, fraction):
+            status_text = "Generated audio segment " + str(completed) + "/" + str(total) + " (cache: " + tts_cache.stats() + ")"
+            on_status(status_text, fraction * .85 + 0.05)
+
+        # the script and every audio segment are kept until the job finishes, so running the
+        # same job again after a crash or failed segments only pays for what is missing
+        # a checkpointed script is only reused when the LLM cache is on; fresh output drops the
+        # checkpoint, its audio belongs to the old script
+        checkpoint = job_checkpoint(settings, "audio", notes_path, voice, settings["notes_prompt"], settings["watsonx_url"], settings["tts_url"], max_bytes, max_tokens)
+        if checkpoint is not None and text_cache is None:
+            checkpoint.clear()
+        script_data = checkpoint.load_text("script.txt") if checkpoint is not None else None
+        if script_data is not None:
+            on_status("Resuming from the checkpointed script...", .05)
+
+        if use_engine:
+            chunks, audio_failures = asyncio.run(narrate_async(settings, sections, voice, script_path, workspace, on_status, script_progress, synthesis_progress,
+                                                               tts_cache, text_cache, max_tokens, max_bytes, metrics, checkpoint, script_data))
+        else:
+            if script_data is None:
+                auth_token = fetch_token(settings, metrics)
+                try:
+                    script_data = generate_batched_script(auth_token, sections, settings["notes_prompt"], parse_positive(settings.get("llm_workers"), DEFAULT_LLM_WORKERS),
+                                                          script_progress, text_cache, settings["watsonx_url"], max_tokens, metrics)
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    raise GenerationError("Script generation failed: " + str(e))
+                if checkpoint is not None:
+                    checkpoint.save_text("script.txt", script_data)
+
+            with open(script_path, "w") as fp:
+                fp.write(script_data)
+
+            # break the text into chunks of no larger than 5k bytes
+            chunks = get_chunks(script_data, max_bytes)
+
+            on_status("Generating audio...", .05)
+            audio_failures = synthesize_chunks(text_to_speech, chunks, voice, workers, synthesis_progress, workspace, tts_cache, metrics, checkpoint)
+
+        on_status("Combining audio files...", .90)
+
+        nums = [num for num in range(len(chunks)) if num not in audio_failures]
+        audio_failures.update(combine_segments(workspace, nums, output_path, metrics, mastering_options(settings)))
+
+        # the final mix is the output file itself; the checkpoint goes once nothing is missing
+        if checkpoint is not None and not audio_failures:
+            checkpoint.clear()
+
+    return {
+        "script_failures": script_failures,
+        "audio_failures": audio_failures,
+        "cache": tts_cache.stats(),
+        "slide_dir": slide_dir
+    }
+
+
+async def narrate_async(settings, sections, voice, script_path, workspace, on_status, script_progress, synthesis_progress, tts_cache, text_cache, max_tokens, max_bytes, metrics,
+                        checkpoint=None, script_data=None):
+    # the script and synthesis steps of the whole-deck path on the async engine; returns
+    # the chunks and the ones that failed. script_data is the checkpointed script, if any
+    async with AsyncServices(settings, engine_limits(settings)) as services:
+        if script_data is None:
+            try:
+                script_data = await generate_batched_script_async(services, sections, settings["notes_prompt"], script_progress, text_cache, max_tokens, metrics)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                raise GenerationError("Script generation failed: " + str(e))
+            if checkpoint is not None:
+                checkpoint.save_text("script.txt", script_data)
+
+        with open(script_path, "w") as fp:
+            fp.write(script_data)
+
+        chunks = get_chunks(script_data, max_bytes)
+
+        on_status("Generating audio...", .05)
+        audio_failures = await synthesize_chunks_async(services, chunks, voice, synthesis_progress, workspace, tts_cache, metrics, checkpoint)
+    return chunks, audio_failures
+
+
+def audio_status(result):
+    if result["audio_failures"] or result["script_failures"]:
+        failed = ", ".join(["slide " + str(slide + 1) + " script" for slide in sorted(result["script_failures"])] + ["segment " + str(num + 1) for num in sorted(result["audio_failures"])])
+        return "Completed with errors in " + failed + ", ensure that the speaker notes are formatted correctly (cache: " + result["cache"] + ")."
+    saved = " to " + os.path.basename(result["output"]) if result.get("output") else ""
+    if result.get("slide_dir"):
+        saved += " and " + os.path.basename(result["slide_dir"])
+    if result.get("stages"):
+        return "Completed successfully" + saved + " (cache: " + result["cache"] + "; " + describe(result["stages"]) + ")."
+    return "Completed successfully" + saved + " (cache: " + result["cache"] + ")."
+
+
+def notes_status(failures):
+    if failures:
+        failed = ", ".join(str(num + 1) for num in sorted(failures))
+        return 'Completed with errors, audio segment(s) ' + failed + ' could not be recognized.'
+    return 'Completed successfully!'
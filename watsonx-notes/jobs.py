@@ -0,0 +1,55 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_JOB_WORKERS = 4
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    # a generation running on the job engine; the generation reports progress through
+    # status(), which is also where a requested cancellation takes effect
+    def __init__(self, name, on_status):
+        self.name = name
+        self.on_status = on_status
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def status(self, text, percent):
+        if self.cancelled:
+            raise JobCancelled(self.name + " was cancelled")
+        self.on_status(text, percent)
+
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+
+class JobEngine:
+    # runs generations on background threads so the UI stays responsive, and lets several
+    # of them (for example notes and audio) run at the same time
+    def __init__(self, max_workers=DEFAULT_JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, name, target, on_status, on_done):
+        # target is called with the job's status callback; on_done receives the job, the
+        # result and the exception raised, if any
+        job = Job(name, on_status)
+        job.future = self.executor.submit(self.run, job, target, on_done)
+        return job
+
+    def run(self, job, target, on_done):
+        try:
+            result = target(job.status)
+        except Exception as e:
+            on_done(job, None, e)
+        else:
+            on_done(job, result, None)
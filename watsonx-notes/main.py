@@ -1,11 +1,8 @@
 import flet as ft
 import json
-from pptx import Presentation
-from ibm_watson import TextToSpeechV1, SpeechToTextV1
-from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
-from pydub import AudioSegment
-import os
-import requests
+from generation import GenerationError, audio_status, generate_audio, generate_notes, load_settings, notes_status
+from jobs import JobCancelled, JobEngine
+from workspace import unique_path
 
 
 def highlight_link(e):
@@ -18,46 +15,76 @@ def unhighlight_link(e):
     e.control.update()
 
 
-def get_chunks(s, maxlength):
-    start = 0
-    end = 0
-    while start + maxlength  < len(s) and end != -1:
-        end = s.rfind(" ", start, start + maxlength + 1)
-        yield s[start:end]
-        start = end + 1
-    yield s[start:]
-
-
-def clean(chunk):
-    return chunk.replace('"', '&quot;').replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("'", "&apos;").replace("\n", "")
-
-
-def get_token(api_key):
-    # Get an IAM token from IBM Cloud
-    url = "https://iam.cloud.ibm.com/identity/token"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json"
-    }
-    data = {
-        "apikey": api_key,
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey"
-    }
-    response = requests.post(url, headers=headers, data=data, verify=False)
-    iam_token = response.json()["access_token"]
-    return "Bearer: " + iam_token
-
-
 class SpeakerNotesApp(ft.Row):
     def __init__(self, page):
         super().__init__()
         self.height = 800
         self.audio_file = None
         self.notes_file = None
-        self.notes_text = None
         self.page = page
-        self.audio_errors = False
+        self.settings = load_settings()
+        self.jobs = JobEngine()
+        self.notes_job = None
+        self.audio_job = None
+
+        self.rail = ft.NavigationRail(
+            selected_index=0,
+            label_type=ft.NavigationRailLabelType.NONE,
+            expand=True,
+            destinations=[
+                ft.NavigationRailDestination(
+                    icon=ft.icons.HOME_OUTLINED, selected_icon=ft.icons.HOME, label="Home"
+                ),
+                ft.NavigationRailDestination(
+                    icon=ft.icons.NOTES_OUTLINED, selected_icon=ft.icons.NOTES, label="Generate notes"
+                ),
+                ft.NavigationRailDestination(
+                    icon=ft.icons.AUDIO_FILE_OUTLINED, selected_icon=ft.icons.AUDIO_FILE, label="Generate audio"
+                ),
+                ft.NavigationRailDestination(
+                    icon=ft.icons.SETTINGS_OUTLINED, selected_icon=ft.icons.SETTINGS, label="Settings"
+                ),
+                ft.NavigationRailDestination(
+                    icon=ft.icons.INFO_OUTLINED, selected_icon=ft.icons.INFO, label="Info"
+                ),
+            ],
+            on_change=self.nav_change
+        )
+
+        self.home_view = ft.Column(
+            visible=True,
+            controls=[
+                ft.Text("Home", size=30, color="blue"),
+                ft.Divider(),
+                ft.Text("It's a well know fact that humans learn and consume information in different modalities. Some prefer to read and then scribble their own notes while other prefer to hear someone else narrate or speak to the content. Neither one is better or worse than the other, merely a reality that teams who want to get their content out to the masses must contend with."),
+                ft.Text("Introducing the watsonx Speaker Notes Assistant, which significantly reduces the time to create powerful voice translations for existing scripts. If English is NOT your 2nd language, if you struggle to sound credible when presenting content or if you are simply looking to save time .. this solution is for you."),
+                ft.Text("Leveraging the power of watsonx, the Speaker Notes Assistant will take your existing presentations and quickly produce voice scripts, or take your recorded videos and generate textual speaker notes. It enables you to deliver more impactful and relevant content for your audiences.")
+            ]
+        )
+
+        # the other views are only built the first time they are opened
+        self.views = [self.home_view, None, None, None, None]
+        self.view_builders = [None, self.build_notes_view, self.build_audio_view, self.build_settings_view, self.build_info_view]
+
+        self.content = ft.Column(
+            width=self.page.width - 100,
+            controls=[
+                self.home_view
+            ]
+        )
+
+        self.controls = [
+            ft.Row(
+                controls=[
+                    self.rail,
+                    ft.VerticalDivider(width=1),
+                    self.content
+                ],
+                expand=True
+            )
+        ]
 
+    def build_notes_view(self):
         # generate notes controls
         def update_notes_status(text, percent):
             self.notes_status_text.value = text
@@ -65,81 +92,41 @@ class SpeakerNotesApp(ft.Row):
             self.notes_status_text.update()
             self.notes_status_ring.update()
 
+        def notes_done(job, failures, error):
+            if isinstance(error, JobCancelled):
+                update_notes_status("Cancelled.", 1.0)
+            elif isinstance(error, GenerationError):
+                update_notes_status(str(error), 1.0)
+            elif error:
+                update_notes_status("Failed: " + str(error), 1.0)
+            else:
+                update_notes_status(notes_status(failures), 1.0)
+            self.generate_notes_button.disabled = False
+            self.generate_notes_button.update()
+            self.cancel_notes_button.visible = False
+            self.cancel_notes_button.update()
+
         def do_generate_notes(_):
             self.generate_notes_button.disabled = True
             self.generate_notes_button.update()
+            self.cancel_notes_button.visible = True
+            self.cancel_notes_button.update()
             self.notes_status_text.visible = True
             self.notes_status_ring.visible = True
 
-            auth_token = get_token(self.api_key.value)
-
-            authenticator = IAMAuthenticator(self.stt_api_key.value)
-            speech_to_text = SpeechToTextV1(authenticator=authenticator)
-            speech_to_text.set_service_url(self.stt_url.value)
-
-            update_notes_status('Recognizing audio file, this may take a few minutes...', .15)
-
-            captured_text = ""
-
-            with open(self.audio_file.path, "rb") as audio_file:
-                try:
-                    response = speech_to_text.recognize(audio_file, content_type="audio/mp3", model='en-US_BroadbandModel').get_result()
-                    for result in response['results']:
-                        captured_text += result['alternatives'][0]['transcript']
-                except Exception as e:
-                    update_notes_status('Failed: ' + e, 1.0)
-                    exit(1)
-
-            update_notes_status('Generating speaker notes text...', .75)
-
-            url = "https://us-south.ml.cloud.ibm.com/ml/v1/text/generation?version=2023-05-29"
-
-            body = {
-                "input": """Rewrite the input text in a more formal and concise style, applying the following changes to it:
-            1. Avoid pronouns like I, you, us, we.
-            2. Expand capitalized acronyms.
-            3. Do not change the name of watsonx.data or watsonx.ai.
-            4. Do not include text referring to speaker notes.
-            5. Do not include these instructions in the output.
-            6. Do not explain the revised output or provide a confidence level.
-
-            Input:""" + captured_text + """
-            Output:
-
-            """,
-                "parameters": {
-                    "decoding_method": "greedy",
-                    "max_new_tokens": 2000,
-                    "repetition_penalty": 1
-                },
-                "model_id": "mistralai/mistral-large",
-                "project_id": self.audio_prompt.value
-            }
-
-            headers = {
-                "Accept": "application/json",
-                "Content-Type": "application/json",
-                "Authorization": auth_token
-            }
-
-            response = requests.post(
-                url,
-                headers=headers,
-                json=body
-            )
-
-            if response.status_code != 200:
-                update_notes_status("Non-200 response: " + str(response.text), 1.0)
-                exit(1)
+            settings = dict(self.settings)
+            audio_path = self.audio_file.path
 
-            update_notes_status('Writing output...', .95)
+            def run(on_status):
+                return generate_notes(settings, audio_path, unique_path(".", "notes_output.txt"), on_status)
 
-            data = response.json()["results"][0]["generated_text"]
+            update_notes_status("Starting...", None)
+            self.notes_job = self.jobs.submit("Notes generation", run, update_notes_status, notes_done)
 
-            with open("notes_output.txt", "w") as text_file:
-                text_file.write(data)
-
-            update_notes_status('Completed successfully!', 1.0)
+        def cancel_notes(_):
+            if self.notes_job and self.notes_job.running():
+                self.notes_job.cancel()
+                update_notes_status("Cancelling...", None)
 
         def audio_file_result(e: ft.FilePickerResultEvent):
             if e.files:
@@ -192,7 +179,16 @@ class SpeakerNotesApp(ft.Row):
             on_click=do_generate_notes
         )
 
+        self.cancel_notes_button = ft.OutlinedButton(
+            text="Cancel",
+            icon=ft.icons.CANCEL,
+            visible=False,
+            on_click=cancel_notes
+        )
+
         def verify_notes_generate():
+            if self.notes_job and self.notes_job.running():
+                return
             if self.audio_file:
                 self.generate_notes_button.disabled = False
             else:
@@ -203,6 +199,30 @@ class SpeakerNotesApp(ft.Row):
             self.notes_status_ring.visible = False
             self.notes_status_ring.update()
 
+        return ft.Column(
+            visible=False,
+            controls=[
+                ft.Text("Generate notes", size=30, color="blue"),
+                ft.Divider(),
+                ft.Text("Select an mp3 file containing your audio."),
+                self.audio_file_icon,
+                self.audio_file_button,
+                ft.Row(
+                    controls=[
+                        self.generate_notes_button,
+                        self.cancel_notes_button
+                    ]
+                ),
+                ft.Row(
+                    controls=[
+                        self.notes_status_ring,
+                        self.notes_status_text
+                    ]
+                )
+            ]
+        )
+
+    def build_audio_view(self):
         # generate audio controls
         def update_audio_status(text, percent):
             self.audio_status_text.value = text
@@ -210,131 +230,45 @@ class SpeakerNotesApp(ft.Row):
             self.audio_status_text.update()
             self.audio_status_ring.update()
 
+        def audio_done(job, result, error):
+            if isinstance(error, JobCancelled):
+                update_audio_status("Cancelled.", 1.0)
+            elif isinstance(error, GenerationError):
+                update_audio_status(str(error), 1.0)
+            elif error:
+                update_audio_status("Failed: " + str(error), 1.0)
+            else:
+                update_audio_status(audio_status(result), 1.0)
+            self.generate_audio_button.disabled = False
+            self.generate_audio_button.update()
+            self.cancel_audio_button.visible = False
+            self.cancel_audio_button.update()
+
         def do_generate_audio(_):
             self.generate_audio_button.disabled = True
             self.generate_audio_button.update()
-            self.audio_errors = False
-            self.notes_text = ""
+            self.cancel_audio_button.visible = True
+            self.cancel_audio_button.update()
             self.audio_status_text.visible = True
             self.audio_status_ring.visible = True
 
-            # determine if the file is ppt; if so, pull the notes
-            if ".ppt" in self.notes_file.name or ".pptx" in self.notes_file.name:
-                update_audio_status("Reading powerpoint slides...", .10)
-                ppt = Presentation(self.notes_file.path)
-                for pg, slide in enumerate(ppt.slides):
-                    text_note = slide.notes_slide.notes_text_frame.text
-                    self.notes_text = self.notes_text + "\n\nSlide " + str(pg + 1) + ": \n" + text_note
-            else:
-                with open(self.notes_file.path, "rb") as fp:
-                    update_audio_status("Reading text file...", .10)
-                    self.notes_text = str(fp.read())
-
-            update_audio_status("Getting script from watsonx prompt...", .15)
-            auth_token = get_token(self.api_key.value)
-
-            url = "https://us-south.ml.cloud.ibm.com/ml/v1/text/generation?version=2023-05-29"
-
-            body = {
-                "input": """Rewrite the the following text in the following manner:
-                1) Make it conversational
-                2) Tone is professional
-                3) Print the slide number
-                4) Remove all URL from the output
-                This is the input:""" + self.notes_text + """
-                Output:""",
-                "parameters": {
-                    "decoding_method": "greedy",
-                    "max_new_tokens": 5000,
-                    "repetition_penalty": 1
-                },
-                "model_id": "mistralai/mistral-large",
-                "project_id": self.notes_prompt.value,
-                "moderations": {
-                    "hap": {
-                        "input": {
-                            "enabled": True,
-                            "threshold": 0.5,
-                            "mask": {
-                                "remove_entity_value": True
-                            }
-                        },
-                        "output": {
-                            "enabled": True,
-                            "threshold": 0.5,
-                            "mask": {
-                                "remove_entity_value": True
-                            }
-                        }
-                    }
-                }
-            }
-
-            headers = {
-                "Accept": "application/json",
-                "Content-Type": "application/json",
-                "Authorization": auth_token
-            }
-
-            response = requests.post(
-                url,
-                headers=headers,
-                json=body
-            )
+            settings = dict(self.settings)
+            notes_path = self.notes_file.path
+            voice = self.voice_dropdown.value
+            pipeline = self.pipeline_checkbox.value
+            stream = self.stream_checkbox.value
+            slide_files = self.slide_files_checkbox.value
 
-            if response.status_code != 200:
-                raise Exception("Non-200 response: " + str(response.text))
-
-            try:
-                script_data = response.json()["results"][0]["generated_text"]
-            except Exception as e:
-                update_audio_status("Script generation failed: " + e, 1.0)
-                exit(1)
-
-            with open("script_output.txt", "w") as fp:
-                fp.write(script_data)
-
-            update_audio_status("Authenticating with TTS service...", .20)
-            authenticator = IAMAuthenticator(self.tts_api_key.value)
-            text_to_speech = TextToSpeechV1(authenticator=authenticator)
-            text_to_speech.set_service_url(self.tts_url.value)
-
-            # break the text into chunks of no larger than 5k bytes
-            chunks = list(get_chunks(script_data, 400))
-
-            for num, chunk in enumerate(chunks):
-                status_text = "Generating audio segment " + str(num + 1) + "/" + str(len(chunks))
-                status_percent = num / len(chunks) * .65 + 0.20
-                update_audio_status(status_text, status_percent)
-                filename = 'temp_output_' + str(num) + '.mp3'
-                clean_chunk = clean(chunk)
-
-                try:
-                    with open(filename, 'wb') as audio_file:
-                        audio_file.write(text_to_speech.synthesize(clean_chunk, voice=self.voice_dropdown.value, accept='audio/mp3').get_result().content)
-                except Exception as e:
-                    self.audio_errors = True
-
-            update_audio_status("Combining audio files...", .90)
-
-            final_audio_output = AudioSegment.silent(duration=100)
-            for num in range(len(chunks)):
-                filename = "temp_output_" + str(num) + '.mp3'
-                try:
-                    final_audio_output = final_audio_output + AudioSegment.from_mp3(filename)
-                except Exception as e:
-                    self.audio_errors = True
-
-            for num in range(len(chunks)):
-                filename = "temp_output_" + str(num) + '.mp3'
-                os.remove(filename)
-
-            final_audio_output.export("final_output.mp3", format="mp3")
-
-            if self.audio_errors:
-                update_audio_status("Completed with errors, ensure that the speaker notes are formatted correctly.", 1.0)
-            else:
-                update_audio_status("Completed successfully.", 1.0)
+            def run(on_status):
+                return generate_audio(settings, notes_path, voice, ".", on_status, pipeline, stream, slide_files=slide_files)
+
+            update_audio_status("Starting...", None)
+            self.audio_job = self.jobs.submit("Audio generation", run, update_audio_status, audio_done)
+
+        def cancel_audio(_):
+            if self.audio_job and self.audio_job.running():
+                self.audio_job.cancel()
+                update_audio_status("Cancelling...", None)
 
         def notes_file_result(e: ft.FilePickerResultEvent):
             if e.files:
@@ -387,7 +321,16 @@ class SpeakerNotesApp(ft.Row):
             on_click=do_generate_audio
         )
 
+        self.cancel_audio_button = ft.OutlinedButton(
+            text="Cancel",
+            icon=ft.icons.CANCEL,
+            visible=False,
+            on_click=cancel_audio
+        )
+
         def verify_audio_generate():
+            if self.audio_job and self.audio_job.running():
+                return
             if self.voice_dropdown.value and self.notes_file:
                 self.generate_audio_button.disabled = False
             else:
@@ -398,6 +341,21 @@ class SpeakerNotesApp(ft.Row):
             self.audio_status_ring.visible = False
             self.audio_status_ring.update()
 
+        self.pipeline_checkbox = ft.Checkbox(
+            label="Script and narrate PowerPoint files slide by slide",
+            value=False
+        )
+
+        self.stream_checkbox = ft.Checkbox(
+            label="Start narrating while the script is still being written",
+            value=False
+        )
+
+        self.slide_files_checkbox = ft.Checkbox(
+            label="Also save the audio of every PowerPoint slide, with chapter markers and an index of the slide times",
+            value=False
+        )
+
         self.voice_dropdown = ft.Dropdown(
             label="Voice",
             on_change=lambda e: verify_audio_generate(),
@@ -408,142 +366,7 @@ class SpeakerNotesApp(ft.Row):
             ]
         )
 
-        # settings controls
-        def settings_changed(_):
-            if self.api_key and (self.stt_api_key.value and self.stt_url.value and self.notes_prompt.value) or (self.tts_api_key.value and self.tts_url.value and self.audio_prompt.value):
-                self.settings_save.disabled = False
-            else:
-                self.settings_save.disabled = True
-            self.settings_save.update()
-
-        def save_settings(_):
-            settings_output = {
-                "api_key": self.api_key.value,
-                "stt_api_key": self.stt_api_key.value,
-                "stt_url": self.stt_url.value,
-                "notes_prompt": self.notes_prompt.value,
-                "audio_prompt": self.audio_prompt.value,
-                "tts_url": self.tts_url.value,
-                "tts_api_key": self.tts_api_key.value
-            }
-
-            with open("settings.json", "w") as f:
-                json.dump(settings_output, f)
-
-        self.api_key = ft.TextField(
-            label="API Key",
-            password=True,
-            can_reveal_password=True,
-            on_change=settings_changed
-        )
-
-        self.stt_api_key = ft.TextField(
-            label="STT API Key",
-            password=True,
-            can_reveal_password=True,
-            on_change=settings_changed
-        )
-
-        self.tts_api_key = ft.TextField(
-            label="TTS API Key",
-            password=True,
-            can_reveal_password=True,
-            on_change=settings_changed
-        )
-
-        self.tts_url = ft.TextField(
-            label="TTS Service URL",
-            value="https://api.us-south.text-to-speech.watson.cloud.ibm.com",
-            on_change=settings_changed
-        )
-
-        self.stt_url = ft.TextField(
-            label="STT Service URL",
-            value="https://api.us-south.speech-to-text.watson.cloud.ibm.com",
-            on_change=settings_changed
-        )
-
-        self.notes_prompt = ft.TextField(
-            label="Notes Prompt",
-            on_change=settings_changed
-        )
-
-        self.audio_prompt = ft.TextField(
-            label="Audio Prompt",
-            on_change=settings_changed
-        )
-
-        self.settings_save = ft.TextButton(text="Save", icon=ft.icons.SAVE, on_click=save_settings, disabled=True)
-
-        try:
-            with open("settings.json", "r") as f:
-                settings = json.load(f)
-                self.api_key.value = settings["api_key"]
-                self.tts_api_key.value = settings["tts_api_key"]
-                self.stt_api_key.value = settings["stt_api_key"]
-                self.tts_url.value = settings["tts_url"]
-                self.stt_url.value = settings["stt_url"]
-                self.audio_prompt.value = settings["audio_prompt"]
-                self.notes_prompt.value = settings["notes_prompt"]
-        except FileNotFoundError:
-            pass
-        except json.decoder.JSONDecodeError:
-            pass
-
-        self.rail = ft.NavigationRail(
-            selected_index=0,
-            label_type=ft.NavigationRailLabelType.NONE,
-            expand=True,
-            destinations=[
-                ft.NavigationRailDestination(
-                    icon=ft.icons.HOME_OUTLINED, selected_icon=ft.icons.HOME, label="Home"
-                ),
-                ft.NavigationRailDestination(
-                    icon=ft.icons.NOTES_OUTLINED, selected_icon=ft.icons.NOTES, label="Generate notes"
-                ),
-                ft.NavigationRailDestination(
-                    icon=ft.icons.AUDIO_FILE_OUTLINED, selected_icon=ft.icons.AUDIO_FILE, label="Generate audio"
-                ),
-                ft.NavigationRailDestination(
-                    icon=ft.icons.SETTINGS_OUTLINED, selected_icon=ft.icons.SETTINGS, label="Settings"
-                ),
-                ft.NavigationRailDestination(
-                    icon=ft.icons.INFO_OUTLINED, selected_icon=ft.icons.INFO, label="Info"
-                ),
-            ],
-            on_change=self.nav_change
-        )
-
-        self.home_view = ft.Column(
-            visible=True,
-            controls=[
-                ft.Text("Home", size=30, color="blue"),
-                ft.Divider(),
-                ft.Text("It's a well know fact that humans learn and consume information in different modalities. Some prefer to read and then scribble their own notes while other prefer to hear someone else narrate or speak to the content. Neither one is better or worse than the other, merely a reality that teams who want to get their content out to the masses must contend with."),
-                ft.Text("Introducing the watsonx Speaker Notes Assistant, which significantly reduces the time to create powerful voice translations for existing scripts. If English is NOT your 2nd language, if you struggle to sound credible when presenting content or if you are simply looking to save time .. this solution is for you."),
-                ft.Text("Leveraging the power of watsonx, the Speaker Notes Assistant will take your existing presentations and quickly produce voice scripts, or take your recorded videos and generate textual speaker notes. It enables you to deliver more impactful and relevant content for your audiences.")
-            ]
-        )
-
-        self.notes_view = ft.Column(
-            visible=False,
-            controls=[
-                ft.Text("Generate notes", size=30, color="blue"),
-                ft.Divider(),
-                ft.Text("Select an mp3 file containing your audio."),
-                self.audio_file_icon,
-                self.audio_file_button,
-                self.generate_notes_button,
-                ft.Row(
-                    controls=[
-                        self.notes_status_ring,
-                        self.notes_status_text
-                    ]
-                )
-            ]
-        )
-
-        self.audio_view = ft.Column(
+        return ft.Column(
             visible=False,
             controls=[
                 ft.Text("Generate audio", size=30, color="blue"),
@@ -564,9 +387,17 @@ class SpeakerNotesApp(ft.Row):
                 ft.Divider(),
                 ft.Text("Select an output voice from the dropdown below, and select a file that contains speaker notes. Valid files include ppt, pptx, and txt files."),
                 self.voice_dropdown,
+                self.pipeline_checkbox,
+                self.stream_checkbox,
+                self.slide_files_checkbox,
                 self.notes_file_icon,
                 self.notes_file_button,
-                self.generate_audio_button,
+                ft.Row(
+                    controls=[
+                        self.generate_audio_button,
+                        self.cancel_audio_button
+                    ]
+                ),
                 ft.Row(
                     controls=[
                         self.audio_status_ring,
@@ -576,7 +407,87 @@ class SpeakerNotesApp(ft.Row):
             ]
         )
 
-        self.settings_view = ft.Column(
+    def build_settings_view(self):
+        # settings controls
+        def settings_changed():
+            settings = self.settings
+            if settings["api_key"] and (settings["stt_api_key"] and settings["stt_url"] and settings["notes_prompt"]) or (settings["tts_api_key"] and settings["tts_url"] and settings["audio_prompt"]):
+                self.settings_save.disabled = False
+            else:
+                self.settings_save.disabled = True
+            self.settings_save.update()
+
+        def save_settings(_):
+            with open("settings.json", "w") as f:
+                json.dump(self.settings, f)
+
+        def settings_field(key, label, password=False):
+            def field_changed(e):
+                self.settings[key] = e.control.value
+                settings_changed()
+
+            return ft.TextField(
+                label=label,
+                value=self.settings[key],
+                password=password,
+                can_reveal_password=password,
+                on_change=field_changed
+            )
+
+        self.api_key = settings_field("api_key", "API Key", password=True)
+        self.watsonx_url = settings_field("watsonx_url", "watsonx.ai URL")
+        self.iam_url = settings_field("iam_url", "IAM URL")
+        self.llm_workers = settings_field("llm_workers", "watsonx.ai Workers")
+        self.script_batch_tokens = settings_field("script_batch_tokens", "Script Batch Tokens")
+        self.stt_api_key = settings_field("stt_api_key", "STT API Key", password=True)
+        self.tts_api_key = settings_field("tts_api_key", "TTS API Key", password=True)
+        self.tts_url = settings_field("tts_url", "TTS Service URL")
+        self.tts_workers = settings_field("tts_workers", "TTS Workers")
+        self.tts_max_bytes = settings_field("tts_max_bytes", "TTS Request Bytes")
+        self.loudness_target = settings_field("loudness_target", "Loudness Target (LUFS)")
+        self.slide_gap = settings_field("slide_gap", "Pause Between Slides (ms)")
+        self.stt_url = settings_field("stt_url", "STT Service URL")
+        self.stt_workers = settings_field("stt_workers", "STT Workers")
+        self.stt_format = settings_field("stt_format", "STT Upload Format (opus, flac or mp3)")
+        self.notes_prompt = settings_field("notes_prompt", "Notes Prompt")
+        self.audio_prompt = settings_field("audio_prompt", "Audio Prompt")
+        self.metrics_file = settings_field("metrics_file", "Timing Log File")
+        self.prometheus_file = settings_field("prometheus_file", "Prometheus Textfile")
+        self.checkpoint_dir = settings_field("checkpoint_dir", "Checkpoint Folder (empty to turn off resuming)")
+
+        def llm_cache_changed(e):
+            self.settings["llm_cache"] = e.control.value
+            settings_changed()
+
+        self.llm_cache = ft.Checkbox(
+            label="Reuse earlier watsonx.ai output for identical requests",
+            value=self.settings["llm_cache"],
+            on_change=llm_cache_changed
+        )
+
+        def async_engine_changed(e):
+            self.settings["async_engine"] = e.control.value
+            settings_changed()
+
+        self.async_engine = ft.Checkbox(
+            label="Send requests from one asyncio event loop instead of a thread per request",
+            value=self.settings["async_engine"],
+            on_change=async_engine_changed
+        )
+
+        def post_process_changed(e):
+            self.settings["post_process"] = e.control.value
+            settings_changed()
+
+        self.post_process = ft.Checkbox(
+            label="Trim silences, even out the loudness and pause between slides in the final audio",
+            value=self.settings["post_process"],
+            on_change=post_process_changed
+        )
+
+        self.settings_save = ft.TextButton(text="Save", icon=ft.icons.SAVE, on_click=save_settings, disabled=True)
+
+        return ft.Column(
             visible=False,
             controls=[
                 ft.Text("Settings", size=30, color="blue"),
@@ -589,6 +500,12 @@ class SpeakerNotesApp(ft.Row):
                 ft.Divider(),
                 ft.Text("You will need an API key to access the watsonx.ai prompts."),
                 self.api_key,
+                self.watsonx_url,
+                self.iam_url,
+                self.llm_workers,
+                self.script_batch_tokens,
+                self.llm_cache,
+                self.async_engine,
                 ft.Divider(),
                 ft.Text(
                     # width=(page.width - 200),
@@ -608,6 +525,8 @@ class SpeakerNotesApp(ft.Row):
                 self.stt_api_key,
                 self.stt_url,
                 self.notes_prompt,
+                self.stt_workers,
+                self.stt_format,
                 ft.Divider(),
                 ft.Text(
                     # width=(page.width - 200),
@@ -627,11 +546,22 @@ class SpeakerNotesApp(ft.Row):
                 ),
                 self.tts_api_key,
                 self.tts_url,
-                self.audio_prompt
+                self.audio_prompt,
+                self.tts_workers,
+                self.tts_max_bytes,
+                self.post_process,
+                self.loudness_target,
+                self.slide_gap,
+                ft.Divider(),
+                ft.Text("Every generation appends the time, bytes and retries of each stage to the timing log as JSON lines. Set a Prometheus textfile to also export the totals of every generation that wrote to it."),
+                self.metrics_file,
+                self.prometheus_file,
+                self.checkpoint_dir
             ]
         )
 
-        self.info_view = ft.Column(
+    def build_info_view(self):
+        return ft.Column(
             visible=False,
             controls=[
                 ft.Text("About", size=30, color="blue"),
@@ -645,43 +575,17 @@ class SpeakerNotesApp(ft.Row):
             ]
         )
 
-        self.controls = [
-            ft.Row(
-                controls=[
-                    self.rail,
-                    ft.VerticalDivider(width=1),
-                    ft.Column(
-                        width=self.page.width - 100,
-                        controls=[
-                            self.home_view,
-                            self.notes_view,
-                            self.audio_view,
-                            self.settings_view,
-                            self.info_view
-                        ]
-                    )
-                ],
-                expand=True
-            )
-        ]
-
     def nav_change(self, e):
-        self.home_view.visible = False
-        self.notes_view.visible = False
-        self.audio_view.visible = False
-        self.settings_view.visible = False
-        self.info_view.visible = False
-        if e.control.selected_index == 0:
-            self.home_view.visible = True
-        elif e.control.selected_index == 1:
-            self.notes_view.visible = True
-        elif e.control.selected_index == 2:
-            self.audio_view.visible = True
-        elif e.control.selected_index == 3:
-            self.settings_view.visible = True
-        elif e.control.selected_index == 4:
-            self.info_view.visible = True
-        self.update()
+        for view in self.views:
+            if view:
+                view.visible = False
+        index = e.control.selected_index
+        if self.views[index] is None:
+            self.views[index] = self.view_builders[index]()
+            self.content.controls.append(self.views[index])
+        self.views[index].visible = True
+        # update the page rather than the row so new file pickers in the overlay are sent too
+        self.page.update()
 
 
 def main(page: ft.Page):
@@ -697,4 +601,5 @@ def main(page: ft.Page):
     page.add(speakernotes)
 
 
-ft.app(target=main)
+if __name__ == "__main__":
+    ft.app(target=main)
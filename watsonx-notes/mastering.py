@@ -0,0 +1,312 @@
+import os
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from audio import Mp3FormatError, iter_mp3_frames, open_file
+
+# numpy is loaded when a narration is mastered, like pydub in audio
+
+# a 10 ms frame is silence below SILENCE_DBFS; each segment keeps EDGE_SILENCE ms of its
+# own silence at a join so sentences are not run together
+TRIM_FRAME = 10
+SILENCE_DBFS = -50
+EDGE_SILENCE = 120
+LOUDNESS_TARGET = -16.0
+PEAK_CEILING = -1.0
+SLIDE_GAP = 750
+# ITU-R BS.1770 gating: 400 ms blocks every 100 ms, absolute and relative gates
+GATE_STEP = 100
+GATE_STEPS = 4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+# samples handled per numpy pass, so memory stays bounded on multi-hour narrations
+BLOCK_SAMPLES = 1 << 20
+MIX_NAME = "mix.pcm"
+DECODE_WORKERS = min(8, os.cpu_count() or 1)
+ENCODE_WORKERS = os.cpu_count() or 1
+# LAME VBR quality of the mastered mix; constant bit rates at the TTS sample rates lose
+# level, which would undo the normalization
+MIX_QUALITY = "4"
+
+
+def source_rate(source, opener):
+    with opener(source) as f:
+        for frame, (version, sample_rate, mono) in iter_mp3_frames(f.read()):
+            return sample_rate
+    return None
+
+
+def decode_segment(source, opener, sample_rate):
+    # one segment as mono 16-bit PCM at sample_rate
+    from pydub import AudioSegment
+
+    with opener(source) as f:
+        data = f.read()
+    result = subprocess.run(
+        [AudioSegment.converter, "-v", "error", "-f", "mp3", "-i", "pipe:0", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "pipe:1"],
+        input=data,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise Exception("ffmpeg exited with status " + str(result.returncode) + ": " + result.stderr.decode("utf-8", "replace").strip())
+    if len(result.stdout) < 2:
+        raise Exception("No audio decoded")
+    return result.stdout[:len(result.stdout) // 2 * 2]
+
+
+def decode_groups(groups, opener, workspace):
+    # decode every segment into one PCM entry of the workspace, a few ffmpeg processes at a
+    # time but written in order; returns the sample rate, the (group, start, end) sample
+    # range of every decoded segment and the segments that failed
+    segments = [(group, num, source) for group, items in enumerate(groups) for num, source in items]
+    sample_rate = None
+    for group, num, source in segments:
+        try:
+            sample_rate = source_rate(source, opener)
+        except Mp3FormatError:
+            continue
+        if sample_rate is not None:
+            break
+
+    ranges = []
+    failures = {}
+    if sample_rate is None:
+        failures.update((num, "No MP3 frames found") for group, num, source in segments)
+        return sample_rate, ranges, failures
+
+    def collect(output, item, future):
+        group, num, source = item
+        try:
+            pcm = future.result()
+        except Exception as e:
+            failures[num] = str(e)
+            return
+        start = ranges[-1][2] if ranges else 0
+        output.write(pcm)
+        ranges.append((group, start, start + len(pcm) // 2))
+
+    # at most DECODE_WORKERS decoded segments wait for the ones before them
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
+    try:
+        with workspace.create(MIX_NAME) as output:
+            for item in segments:
+                pending.append((item, executor.submit(decode_segment, item[2], opener, sample_rate)))
+                if len(pending) > DECODE_WORKERS:
+                    collect(output, *pending.popleft())
+            while pending:
+                collect(output, *pending.popleft())
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return sample_rate, ranges, failures
+
+
+def frame_levels(pcm, size, weights=None):
+    # mean square (full scale 1.0) of every size-sample frame; with weights, of the frame
+    # filtered by the filter whose power response per rfft bin weights is, by Parseval
+    import numpy as np
+
+    count = len(pcm) // size
+    levels = np.empty(count)
+    rows = max(1, BLOCK_SAMPLES // size)
+    for start in range(0, count, rows):
+        stop = min(start + rows, count)
+        frames = pcm[start * size:stop * size].reshape(-1, size).astype(np.float64)
+        if weights is None:
+            levels[start:stop] = np.einsum("ij,ij->i", frames, frames) / size
+        else:
+            spectrum = np.fft.rfft(frames, axis=1)
+            levels[start:stop] = (spectrum.real ** 2 + spectrum.imag ** 2) @ weights / size ** 2
+    return levels / 32768.0 ** 2
+
+
+def biquad_power(b, a, freqs, sample_rate):
+    import numpy as np
+
+    z = np.exp(-2j * np.pi * freqs / sample_rate)
+    return np.abs((b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)) ** 2
+
+
+def k_weighting(freqs, sample_rate):
+    # power response of the BS.1770 K filter (high shelf and high pass) at any sample rate
+    import numpy as np
+
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = biquad_power([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0],
+                         [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0], freqs, sample_rate)
+
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    high_pass = biquad_power([1, -2, 1], [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0], freqs, sample_rate)
+    return shelf * high_pass
+
+
+def integrated_loudness(pcm, sample_rate, ranges=None):
+    # gated BS.1770 loudness in LUFS, or None when everything is below the absolute gate.
+    # 400 ms block levels are the means of four 100 ms step levels; with ranges, only the
+    # blocks that lie within one of the (group, start, end) sample ranges count
+    import numpy as np
+
+    size = sample_rate * GATE_STEP // 1000
+    weights = k_weighting(np.fft.rfftfreq(size, 1 / sample_rate), sample_rate)
+    # one-sided spectrum: every bin but DC and Nyquist stands for two
+    weights[1:] *= 2
+    if size % 2 == 0:
+        weights[-1] /= 2
+    steps = frame_levels(pcm, size, weights)
+    if len(steps) < GATE_STEPS:
+        return None
+    blocks = np.convolve(steps, np.ones(GATE_STEPS) / GATE_STEPS, "valid")
+    if ranges is not None:
+        kept = np.zeros(len(steps))
+        for group, start, end in ranges:
+            kept[-(-start // size):end // size] = 1
+        blocks = blocks[np.convolve(kept, np.ones(GATE_STEPS), "valid") == GATE_STEPS]
+    blocks = blocks[blocks > 10 ** ((ABSOLUTE_GATE + 0.691) / 10)]
+    if not len(blocks):
+        return None
+    blocks = blocks[blocks > blocks.mean() * 10 ** (RELATIVE_GATE / 10)]
+    return -0.691 + 10 * np.log10(blocks.mean())
+
+
+def trimmed_ranges(pcm, sample_rate, ranges):
+    # cut each segment's leading and trailing silence down to EDGE_SILENCE; the loud frames of
+    # all segments are found at once and each segment looks up its first and last one
+    import numpy as np
+
+    size = sample_rate * TRIM_FRAME // 1000
+    edge = sample_rate * EDGE_SILENCE // 1000
+    loud = np.flatnonzero(frame_levels(pcm, size) > 10 ** (SILENCE_DBFS / 10))
+    starts = np.array([start for group, start, end in ranges])
+    ends = np.array([end for group, start, end in ranges])
+    first = np.searchsorted(loud, -(-starts // size))
+    last = np.searchsorted(loud, ends // size) - 1
+    trimmed = []
+    for num, (group, start, end) in enumerate(ranges):
+        if last[num] < first[num]:
+            # nothing but silence
+            continue
+        trimmed.append((group, max(start, int(loud[first[num]]) * size - edge), min(end, (int(loud[last[num]]) + 1) * size + edge)))
+    return trimmed
+
+
+def write_mix(pcm, sample_rate, grouped, gain, lead_in, slide_gap, output):
+    # scale the kept (start, end) ranges of every group block by block into output, with
+    # slide_gap ms between groups that have audio; returns the (start, end) of every group in ms
+    import numpy as np
+
+    spans = []
+    lead_in_samples = written = sample_rate * lead_in // 1000
+    output.write(bytes(written * 2))
+    for ranges in grouped:
+        if ranges and written > lead_in_samples:
+            gap = sample_rate * slide_gap // 1000
+            output.write(bytes(gap * 2))
+            written += gap
+        start_ms = written * 1000 // sample_rate
+        for start, end in ranges:
+            for block_start in range(start, end, BLOCK_SAMPLES):
+                block = pcm[block_start:min(end, block_start + BLOCK_SAMPLES)].astype(np.float32)
+                block *= gain
+                np.rint(block, out=block)
+                np.clip(block, -32768, 32767, out=block)
+                output.write(block.astype("<i2").tobytes())
+            written += end - start
+        spans.append((start_ms, written * 1000 // sample_rate))
+    return spans
+
+
+def mix_gain(pcm, sample_rate, ranges, loudness):
+    # the gain that brings the ranges to loudness LUFS without going over the peak ceiling
+    import numpy as np
+
+    measured = integrated_loudness(pcm, sample_rate, ranges) if loudness is not None else None
+    if measured is None:
+        return 1.0
+    peak = max([max(-int(pcm[start:end].min()), int(pcm[start:end].max())) for group, start, end in ranges] or [0])
+    gain_db = loudness - measured
+    if peak:
+        # never push the loudest sample over the ceiling
+        gain_db = min(gain_db, PEAK_CEILING - 20 * np.log10(peak / 32768))
+    return float(10 ** (gain_db / 20))
+
+
+def encode_mix(output_path, sample_rate, write):
+    # write gets the stdin of an ffmpeg process that encodes it into output_path
+    from pydub import AudioSegment
+
+    encoder = subprocess.Popen(
+        [AudioSegment.converter, "-v", "error", "-y", "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0", "-q:a", MIX_QUALITY, "-f", "mp3", output_path],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        result = write(encoder.stdin)
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+    if encoder.returncode != 0:
+        raise Exception("ffmpeg exited with status " + str(encoder.returncode))
+    return result
+
+
+def encode_mastered(view, sample_rate, ranges, group_count, output_path, group_paths, lead_in, loudness, slide_gap):
+    # the mix and the file of every group are encoded at the same time, one ffmpeg process
+    # each, all reading the same PCM; returns the spans of the groups in the mix and the
+    # path of every group file written, or None for the groups with no audio left
+    import numpy as np
+
+    pcm = np.frombuffer(view, dtype="<i2")
+    ranges = trimmed_ranges(pcm, sample_rate, ranges)
+    gain = mix_gain(pcm, sample_rate, ranges, loudness)
+    grouped = [[] for group in range(group_count)]
+    for group, start, end in ranges:
+        grouped[group].append((start, end))
+
+    executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS)
+    try:
+        mix = executor.submit(encode_mix, output_path, sample_rate, lambda output: write_mix(pcm, sample_rate, grouped, gain, lead_in, slide_gap, output))
+        written = [path if path is not None and group else None for path, group in zip(group_paths or [None] * group_count, grouped)]
+        files = [executor.submit(encode_mix, path, sample_rate, lambda output, group=group: write_mix(pcm, sample_rate, [group], gain, 0, 0, output))
+                 for path, group in zip(written, grouped) if path is not None]
+        for future in files:
+            future.result()
+        return mix.result(), written
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def master_mp3(groups, output_path, workspace, opener=open_file, lead_in=100, loudness=LOUDNESS_TARGET, slide_gap=SLIDE_GAP, group_paths=None):
+    # join groups (one list of (chunk number, mp3 source) per slide, in playback order) into
+    # output_path with the silence at every join trimmed, the loudness normalized to loudness
+    # LUFS unless it is None and slide_gap ms between the groups. group_paths, if given, has
+    # the file each group is also written to on its own, or None. Everything runs on the
+    # decoded PCM as numpy arrays; returns the chunks that could not be decoded (all of them
+    # when nothing but silence was left), the (start, end) of every group in the output in ms
+    # and the group files written, or None
+    from pydub import AudioSegment
+
+    try:
+        sample_rate, ranges, failures = decode_groups(groups, opener, workspace)
+        if not ranges:
+            AudioSegment.silent(duration=lead_in).export(output_path, format="mp3")
+            return failures, [(lead_in, lead_in)] * len(groups), [None] * len(groups)
+
+        view = workspace.view(MIX_NAME)
+        spans, written = encode_mastered(view, sample_rate, ranges, len(groups), output_path, group_paths, lead_in, loudness, slide_gap)
+        if hasattr(view, "close"):
+            # nothing points into the map once encode_mastered has returned
+            view.close()
+    finally:
+        workspace.remove(MIX_NAME)
+    if all(start == end for start, end in spans):
+        # every decoded segment was trimmed away as silence, so there is no narration
+        failures.update((num, "Only silence") for items in groups for num, source in items if num not in failures)
+    return failures, spans, written
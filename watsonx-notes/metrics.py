@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = "watsonx_notes"
+PROMETHEUS_METRICS = [
+    ("stage_calls_total", "calls", "Spans recorded for each stage"),
+    ("stage_seconds_total", "seconds", "Seconds spent in each stage"),
+    ("stage_bytes_sent_total", "bytes_sent", "Bytes sent to a service in each stage"),
+    ("stage_bytes_received_total", "bytes_received", "Bytes received from a service in each stage"),
+    ("stage_retries_total", "retries", "Retried requests in each stage"),
+    ("stage_errors_total", "errors", "Spans in each stage that ended with an error")
+]
+# a lock file older than this was left behind by a writer that crashed
+PROMETHEUS_LOCK_SECONDS = 10
+
+_prometheus_lock = threading.Lock()
+
+
+class Metrics:
+    # timing spans for one job: each span is appended to a JSON lines file as soon as it
+    # ends, and the per-stage totals can be added to a Prometheus textfile at the end
+    def __init__(self, job, path=None, prometheus_path=None):
+        self.job = job
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.started = time.time()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, **fields):
+        # the caller can fill in bytes_sent, bytes_received and retries on the yielded record
+        record = dict(fields, stage=stage, bytes_sent=0, bytes_received=0, retries=0)
+        started = time.time()
+        clock = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__ + ": " + str(e)
+            raise
+        finally:
+            record["start"] = round(started, 3)
+            record["seconds"] = round(time.perf_counter() - clock, 6)
+            self.add(record)
+
+    def add(self, record):
+        with self.lock:
+            totals = self.stages.setdefault(record["stage"], {"calls": 0, "seconds": 0.0, "bytes_sent": 0, "bytes_received": 0, "retries": 0, "errors": 0})
+            totals["calls"] += 1
+            totals["seconds"] += record["seconds"]
+            totals["bytes_sent"] += record["bytes_sent"]
+            totals["bytes_received"] += record["bytes_received"]
+            totals["retries"] += record["retries"]
+            totals["errors"] += 1 if "error" in record else 0
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(dict(record, job=self.job, job_id=self.id)) + "\n")
+
+    def summary(self):
+        with self.lock:
+            return {stage: dict(totals, seconds=round(totals["seconds"], 3)) for stage, totals in self.stages.items()}
+
+    def write_prometheus(self):
+        # the counters in the textfile are the totals of every job that wrote to it, from
+        # any thread or batch process; job_seconds is the wall time of the last job
+        if not self.prometheus_path:
+            return
+        summary = self.summary()
+        with locked_file(self.prometheus_path):
+            samples = read_samples(self.prometheus_path)
+            for name, field, description in PROMETHEUS_METRICS:
+                for stage, totals in summary.items():
+                    series = PROMETHEUS_PREFIX + "_" + name + '{job="' + self.job + '",stage="' + stage + '"}'
+                    samples[series] = samples.get(series, 0) + totals[field]
+            samples[PROMETHEUS_PREFIX + '_job_seconds{job="' + self.job + '"}'] = round(time.time() - self.started, 3)
+
+            lines = []
+            families = [(name, description, "counter") for name, field, description in PROMETHEUS_METRICS] + [("job_seconds", "Wall time of the last job", "gauge")]
+            for name, description, kind in families:
+                lines.append("# HELP " + PROMETHEUS_PREFIX + "_" + name + " " + description)
+                lines.append("# TYPE " + PROMETHEUS_PREFIX + "_" + name + " " + kind)
+                for series in sorted(samples):
+                    if series.startswith(PROMETHEUS_PREFIX + "_" + name + "{"):
+                        lines.append(series + " " + sample_value(samples[series]))
+
+            # node_exporter reads textfiles at any time, so replace the file in one step
+            temp_path = self.prometheus_path + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp"
+            with open(temp_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(temp_path, self.prometheus_path)
+
+
+@contextmanager
+def locked_file(path):
+    # one writer of path at a time across threads and processes: the lock file next to it is
+    # created exclusively, and taken over once it is stale
+    lock_path = path + ".lock"
+    with _prometheus_lock:
+        while True:
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    stale = time.time() - os.path.getmtime(lock_path) > PROMETHEUS_LOCK_SECONDS
+                    if stale:
+                        os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.remove(lock_path)
+
+
+def read_samples(path):
+    # the samples of a textfile by series; comments are left out
+    samples = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    series, _, value = line.rpartition(" ")
+                    samples[series] = float(value)
+    except FileNotFoundError:
+        pass
+    return samples
+
+
+def sample_value(value):
+    return str(int(value)) if value == int(value) else str(round(value, 6))
+
+
+@contextmanager
+def span(metrics, stage, **fields):
+    # lets functions take metrics=None like they take cache=None
+    if metrics is None:
+        yield dict(fields, stage=stage, bytes_sent=0, bytes_received=0, retries=0)
+    else:
+        with metrics.span(stage, **fields) as record:
+            yield record
+
+
+def describe(summary, limit=3):
+    # the stages that took longest, for status messages
+    slowest = sorted(summary.items(), key=lambda item: -item[1]["seconds"])[:limit]
+    return ", ".join(stage + " " + str(round(totals["seconds"], 1)) + " s" for stage, totals in slowest)
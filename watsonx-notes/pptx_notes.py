@@ -0,0 +1,96 @@
+import posixpath
+import zipfile
+from xml.etree.ElementTree import ParseError, iterparse
+
+NS_P = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+NS_A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+NS_R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+NOTES_SLIDE_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/notesSlide"
+
+
+class NotesFormatError(Exception):
+    pass
+
+
+def rels_path(part):
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, "_rels", name + ".rels")
+
+
+def relationships(package, part):
+    # rId -> (type, part name) for the relationships of part; external targets are skipped
+    targets = {}
+    try:
+        source = package.open(rels_path(part))
+    except KeyError:
+        return targets
+    with source:
+        for _, element in iterparse(source):
+            if element.tag == NS_RELS + "Relationship" and element.get("TargetMode") != "External":
+                target = element.get("Target")
+                if target.startswith("/"):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join(posixpath.dirname(part), target))
+                targets[element.get("Id")] = (element.get("Type"), target)
+    return targets
+
+
+def slide_parts(package):
+    # slide part names in presentation order, read from the slide id list
+    presentation_rels = relationships(package, "ppt/presentation.xml")
+    parts = []
+    with package.open("ppt/presentation.xml") as source:
+        for _, element in iterparse(source):
+            if element.tag == NS_P + "sldId":
+                parts.append(presentation_rels[element.get(NS_R + "id")][1])
+            elif element.tag == NS_P + "sldIdLst":
+                # the slide list comes before the notes master and everything else
+                break
+    return parts
+
+
+def paragraph_text(paragraph):
+    # the same text python-pptx gives: runs and fields as written, line breaks as \v
+    text = ""
+    for element in paragraph:
+        if element.tag in (NS_A + "r", NS_A + "fld"):
+            text += "".join(element.itertext())
+        elif element.tag == NS_A + "br":
+            text += "\v"
+    return text
+
+
+def notes_text(source):
+    # text of the body placeholder of a notes slide, the one PowerPoint shows as the notes
+    for _, element in iterparse(source):
+        if element.tag != NS_P + "sp":
+            continue
+        placeholder = element.find(NS_P + "nvSpPr/" + NS_P + "nvPr/" + NS_P + "ph")
+        body = element.find(NS_P + "txBody")
+        if placeholder is not None and placeholder.get("type") == "body" and body is not None:
+            return "\n".join(paragraph_text(paragraph) for paragraph in body.findall(NS_A + "p"))
+        element.clear()
+    return ""
+
+
+def read_notes(path):
+    # speaker notes of every slide in order, "" for slides without notes; only the
+    # presentation, its relationships and the notes slides are read from the package
+    try:
+        with zipfile.ZipFile(path) as package:
+            notes = []
+            for slide in slide_parts(package):
+                notes_part = None
+                for kind, target in relationships(package, slide).values():
+                    if kind == NOTES_SLIDE_TYPE:
+                        notes_part = target
+                if notes_part is None:
+                    notes.append("")
+                    continue
+                with package.open(notes_part) as source:
+                    notes.append(notes_text(source))
+            return notes
+    except (KeyError, ParseError, zipfile.BadZipFile) as e:
+        raise NotesFormatError("Not a PowerPoint package: " + str(e))
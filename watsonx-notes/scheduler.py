@@ -0,0 +1,199 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# status codes worth another attempt; the throttling ones also lower the concurrency limit
+RETRY_CODES = (429, 500, 502, 503, 504)
+THROTTLE_CODES = (429, 503)
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+MAX_CONCURRENCY = 32
+
+
+class ResponseError(Exception):
+    # a non-200 response from a service called with requests or aiohttp directly; code and
+    # http_response mirror the SDK's ApiException so all of them are handled the same way.
+    # aiohttp responses need their text read beforehand, since that is a coroutine
+    def __init__(self, response, text=None):
+        super().__init__("Non-200 response: " + str(response.text if text is None else text))
+        self.code = getattr(response, "status_code", None) or response.status
+        self.http_response = response
+
+
+def retry_after(error):
+    # seconds asked for by a Retry-After header, given as a delay or a date
+    response = getattr(error, "http_response", None)
+    value = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retryable(error):
+    code = getattr(error, "code", None)
+    if code is not None:
+        return code in RETRY_CODES
+    # connection resets and timeouts, including the requests exceptions built on OSError
+    return isinstance(error, OSError)
+
+
+class RequestScheduler:
+    # shared by every thread that calls one service: at most limit requests are in flight,
+    # the limit grows by one after a limit's worth of successes and halves when the service
+    # pushes back, and everyone waits out a Retry-After before sending again
+    def __init__(self, name, max_limit=MAX_CONCURRENCY, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.name = name
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.active = 0
+        self.resume_at = 0
+        self.condition = threading.Condition()
+
+    def set_max_limit(self, max_limit):
+        # a new ceiling for a pool with another number of workers; the limit moves by as much,
+        # so what the service pushed back on is not forgotten
+        with self.condition:
+            self.limit = max(1.0, min(float(max_limit), self.limit + max_limit - self.max_limit))
+            self.max_limit = max_limit
+            self.condition.notify_all()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.resume_at - time.monotonic()
+                if wait <= 0 and self.active < int(self.limit):
+                    break
+                self.condition.wait(wait if wait > 0 else None)
+            self.active += 1
+
+    def release(self, succeeded):
+        with self.condition:
+            self.active -= 1
+            if succeeded:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def throttle(self, delay):
+        with self.condition:
+            now = time.monotonic()
+            # requests already in flight when the service pushed back count as one signal
+            if now >= self.resume_at:
+                self.limit = max(1.0, self.limit / 2)
+            self.resume_at = max(self.resume_at, now + delay)
+            self.condition.notify_all()
+
+    def backoff(self, attempt):
+        # full jitter keeps retries from many threads from arriving together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, request, *args, record=None):
+        # record, if given, is a metrics span that counts the retries
+        for attempt in range(self.attempts):
+            self.acquire()
+            try:
+                result = request(*args)
+            except Exception as e:
+                self.release(False)
+                if attempt + 1 == self.attempts or not retryable(e):
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                if record is not None:
+                    record["retries"] += 1
+                if getattr(e, "code", None) in THROTTLE_CODES:
+                    self.throttle(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            self.release(True)
+            return result
+
+
+class AsyncRequestScheduler(RequestScheduler):
+    # the same policy for coroutines; asyncio primitives belong to the event loop they are
+    # first used on, so every run of the async engine creates its own schedulers
+    def __init__(self, name, max_limit=MAX_CONCURRENCY, **options):
+        super().__init__(name, max_limit, **options)
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            while True:
+                wait = self.resume_at - time.monotonic()
+                if wait <= 0 and self.active < int(self.limit):
+                    break
+                try:
+                    await asyncio.wait_for(self.condition.wait(), wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+            self.active += 1
+
+    async def release(self, succeeded):
+        async with self.condition:
+            self.active -= 1
+            if succeeded:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    async def throttle(self, delay):
+        async with self.condition:
+            now = time.monotonic()
+            if now >= self.resume_at:
+                self.limit = max(1.0, self.limit / 2)
+            self.resume_at = max(self.resume_at, now + delay)
+            self.condition.notify_all()
+
+    async def call(self, request, *args, record=None):
+        # request is a coroutine function; cancelling the caller cancels the request in flight
+        for attempt in range(self.attempts):
+            await self.acquire()
+            try:
+                result = await request(*args)
+            except Exception as e:
+                await self.release(False)
+                if attempt + 1 == self.attempts or not retryable(e):
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                if record is not None:
+                    record["retries"] += 1
+                if getattr(e, "code", None) in THROTTLE_CODES:
+                    await self.throttle(delay)
+                else:
+                    await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                await asyncio.shield(self.release(False))
+                raise
+            await self.release(True)
+            return result
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name, max_limit=None):
+    # max_limit, if given, is the worker count of the pool calling the service: a new
+    # scheduler starts at it and an existing one takes it as its new ceiling
+    with _schedulers_lock:
+        if name not in _schedulers:
+            _schedulers[name] = RequestScheduler(name, max_limit or MAX_CONCURRENCY)
+        elif max_limit is not None and max_limit != _schedulers[name].max_limit:
+            _schedulers[name].set_max_limit(max_limit)
+        return _schedulers[name]
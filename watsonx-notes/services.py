@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+from scheduler import ResponseError
+
+# requests and the IBM SDKs are slow to import, so they are loaded by the first call that
+# needs them rather than when the app starts
+
+IAM_URL = "https://iam.cloud.ibm.com"
+WATSONX_URL = "https://us-south.ml.cloud.ibm.com"
+GENERATION_PATH = "/ml/v1/text/generation?version=2023-05-29"
+GENERATION_STREAM_PATH = "/ml/v1/text/generation_stream?version=2023-05-29"
+GENERATION_URL = WATSONX_URL + GENERATION_PATH
+GENERATION_STREAM_URL = WATSONX_URL + GENERATION_STREAM_PATH
+
+# refresh tokens this many seconds before IBM Cloud says they expire
+TOKEN_REFRESH_MARGIN = 120
+# enough keep-alive connections per host for a full pool of concurrent workers
+POOL_SIZE = 32
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+TOKEN_HEADERS = {
+    "Content-Type": "application/x-www-form-urlencoded",
+    "Accept": "application/json"
+}
+
+
+def token_request(api_key):
+    # the form data of an IAM token request
+    return {
+        "apikey": api_key,
+        "grant_type": "urn:ibm:params:oauth:grant-type:apikey"
+    }
+
+
+class TokenManager:
+    # IAM tokens by API key and IAM URL, each kept until margin seconds before it expires;
+    # the async engine keeps its tokens in one as well and only makes the request itself
+    def __init__(self, margin=TOKEN_REFRESH_MARGIN):
+        self.margin = margin
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    def get(self, api_key, url=IAM_URL):
+        with self.lock:
+            token = self.cached(api_key, url)
+            if token is None:
+                response = get_session().post(url + "/identity/token", headers=TOKEN_HEADERS, data=token_request(api_key), verify=False)
+                if response.status_code != 200:
+                    raise ResponseError(response)
+                token = self.store(api_key, url, response.json())
+            return token
+
+    def cached(self, api_key, url):
+        # the token, or None when there is none or it is about to expire
+        cached = self.tokens.get((api_key, url))
+        if cached and time.monotonic() < cached[1]:
+            return cached[0]
+        return None
+
+    def store(self, api_key, url, result):
+        # keeps the token of an IAM response and returns it
+        expires_at = time.monotonic() + result.get("expires_in", 3600) - self.margin
+        self.tokens[(api_key, url)] = (result["access_token"], expires_at)
+        return result["access_token"]
+
+
+token_manager = TokenManager()
+
+
+def get_token(api_key, url=IAM_URL):
+    # Get an IAM token from IBM Cloud, reusing the cached one until it is close to expiring
+    return "Bearer: " + token_manager.get(api_key, url)
+
+
+_authenticators = {}
+_authenticators_lock = threading.Lock()
+
+
+def get_authenticator(api_key, url=IAM_URL):
+    # the SDK authenticator caches and refreshes its own token, so keep one per key
+    from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
+
+    with _authenticators_lock:
+        if (api_key, url) not in _authenticators:
+            _authenticators[(api_key, url)] = IAMAuthenticator(api_key, url=url)
+        return _authenticators[(api_key, url)]
+
+
+def get_text_to_speech(api_key, url, iam_url=IAM_URL):
+    from ibm_watson import TextToSpeechV1
+
+    text_to_speech = TextToSpeechV1(authenticator=get_authenticator(api_key, iam_url))
+    text_to_speech.set_service_url(url)
+    text_to_speech.set_http_client(get_session())
+    return text_to_speech
+
+
+def get_speech_to_text(api_key, url, iam_url=IAM_URL):
+    from ibm_watson import SpeechToTextV1
+
+    speech_to_text = SpeechToTextV1(authenticator=get_authenticator(api_key, iam_url))
+    speech_to_text.set_service_url(url)
+    speech_to_text.set_http_client(get_session())
+    return speech_to_text
+
+
+def generate_text(auth_token, body, url=GENERATION_URL):
+    headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "Authorization": auth_token
+    }
+
+    return get_session().post(
+        url,
+        headers=headers,
+        json=body
+    )
+
+
+def iter_events(lines):
+    # parse server-sent event lines into (event, data) pairs
+    event, data = "message", []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+    if data:
+        yield event, "\n".join(data)
+
+
+def open_stream(auth_token, body, url=GENERATION_STREAM_URL):
+    headers = {
+        "Accept": "text/event-stream",
+        "Content-Type": "application/json",
+        "Authorization": auth_token
+    }
+
+    response = get_session().post(url, headers=headers, json=body, stream=True)
+    if response.status_code != 200:
+        raise ResponseError(response)
+    return response
+
+
+def stream_pieces(response):
+    # yields the generated text piece by piece as the service produces it
+    with response:
+        lines = (line.decode("utf-8") for line in response.iter_lines())
+        for event, data in iter_events(lines):
+            if event == "error":
+                raise Exception("Stream error: " + data)
+            for result in json.loads(data).get("results", []):
+                yield result.get("generated_text", "")
+
+
+def stream_text(auth_token, body, url=GENERATION_STREAM_URL):
+    return stream_pieces(open_stream(auth_token, body, url))
@@ -0,0 +1,165 @@
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+
+# segments a job holds in memory before new ones go to its temporary directory
+WORKSPACE_SPILL_BYTES = 64 * 1024 * 1024
+
+
+class Workspace:
+    # private scratch space for one job's intermediate files: entries are kept as bytes
+    # until the job holds spill_bytes in memory, after that they are written to a temporary
+    # directory that is removed with the workspace
+    def __init__(self, spill_bytes=WORKSPACE_SPILL_BYTES):
+        self.spill_bytes = spill_bytes
+        self.memory = 0
+        self.entries = {}
+        self.directory = None
+        self.spills = 0
+        self.lock = threading.Lock()
+
+    def create(self, name):
+        # a writer for the entry; it replaces any entry of that name when closed, and leaves
+        # nothing behind if the with block raises
+        return WorkspaceWriter(self, name)
+
+    def reserve(self, size):
+        with self.lock:
+            if self.memory + size > self.spill_bytes:
+                return False
+            self.memory += size
+            return True
+
+    def release(self, size):
+        with self.lock:
+            self.memory -= size
+
+    def spill_path(self, name):
+        # a new file for every write, so rewriting an entry never touches the file it replaces
+        with self.lock:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix="watsonx-notes-")
+            self.spills += 1
+            return os.path.join(self.directory, name + "." + str(self.spills))
+
+    def commit(self, name, value):
+        self.remove(name)
+        with self.lock:
+            self.entries[name] = value
+
+    def open(self, name):
+        value = self.entries[name]
+        if isinstance(value, bytes):
+            return io.BytesIO(value)
+        return open(value, "rb")
+
+    def view(self, name):
+        # the entry's contents without a copy: its bytes, or a read-only memory map of its
+        # file that the caller closes
+        value = self.entries[name]
+        if isinstance(value, bytes):
+            return value
+        with open(value, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def size(self, name):
+        value = self.entries[name]
+        if isinstance(value, bytes):
+            return len(value)
+        return os.path.getsize(value)
+
+    def remove(self, name):
+        with self.lock:
+            value = self.entries.pop(name, None)
+            if isinstance(value, bytes):
+                self.memory -= len(value)
+        if isinstance(value, str):
+            os.remove(value)
+
+    def close(self):
+        with self.lock:
+            self.entries.clear()
+            self.memory = 0
+            directory, self.directory = self.directory, None
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class WorkspaceWriter:
+    def __init__(self, workspace, name):
+        self.workspace = workspace
+        self.name = name
+        self.buffer = io.BytesIO()
+        self.reserved = 0
+        self.file = None
+
+    def write(self, data):
+        if self.file is None:
+            if self.workspace.reserve(len(data)):
+                self.reserved += len(data)
+                return self.buffer.write(data)
+            # over the job's memory budget, move what was written so far to disk
+            self.file = open(self.workspace.spill_path(self.name), "wb")
+            self.file.write(self.buffer.getvalue())
+            self.workspace.release(self.reserved)
+            self.reserved = 0
+            self.buffer = None
+        return self.file.write(data)
+
+    def close(self):
+        if self.file is None:
+            # the bytes were counted against the budget as they were written
+            self.workspace.commit(self.name, self.buffer.getvalue())
+        else:
+            self.file.close()
+            self.workspace.commit(self.name, self.file.name)
+
+    def discard(self):
+        if self.file is None:
+            self.workspace.release(self.reserved)
+        else:
+            self.file.close()
+            os.remove(self.file.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def unique_path(directory, name):
+    # reserve name in directory, or name-2, name-3 and so on when an earlier or concurrent
+    # job already has it, so no two jobs write the same output file
+    os.makedirs(directory, exist_ok=True)
+    stem, extension = os.path.splitext(name)
+    count = 1
+    while True:
+        path = os.path.join(directory, name if count == 1 else stem + "-" + str(count) + extension)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            count += 1
+
+
+def discard_empty(paths):
+    # remove output files a failed job reserved but never wrote
+    for path in paths:
+        try:
+            if not os.path.getsize(path):
+                os.remove(path)
+        except FileNotFoundError:
+            pass